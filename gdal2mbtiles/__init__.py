@@ -17,7 +17,4 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 __version__ = '2.1.1'
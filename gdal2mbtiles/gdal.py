@@ -17,12 +17,6 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
-# Make sure we are using the python 3 version of round in both python 2 and 3
-from builtins import round
-
 from functools import partial
 import logging
 from math import pi
@@ -40,12 +34,6 @@ from osgeo.gdalconst import (GA_ReadOnly, GRA_Bilinear, GRA_Cubic,
                              GRA_CubicSpline, GRA_Lanczos,
                              GRA_NearestNeighbour)
 
-try:
-  basestring
-except NameError:
-  basestring = str
-
-
 gdal.UseExceptions()            # Make GDAL throw exceptions on error
 osr.UseExceptions()             # And OSR as well.
 
@@ -193,7 +181,7 @@ def warp(inputfile, spatial_ref=None, cmd=GDALWARP, resampling=None,
 
     # Resampling method
     if resampling is not None:
-        if not isinstance(resampling, basestring):
+        if not isinstance(resampling, str):
             try:
                 resampling = RESAMPLING_METHODS[resampling]
             except KeyError:
@@ -428,6 +416,10 @@ class Dataset(gdal.Dataset):
         self._geotransform = None
         self._rastersizes = None
 
+        # Cache of (world, data) TMS extents for GetWorldTmsBorders, keyed by
+        # resolution.
+        self._tms_borders_extents = {}
+
     def IsWholeWorld(self, resolution=None):
         """
         Returns whether the dataset covers the whole world or not.
@@ -476,6 +468,7 @@ class Dataset(gdal.Dataset):
 
     def SetGeoTransform(self, geotransform, local=False):
         self._geotransform = geotransform
+        self._tms_borders_extents.clear()
         if local is False:
             # Write to the file only if we want/can.
             super(Dataset, self).SetGeoTransform(geotransform)
@@ -760,10 +753,17 @@ class Dataset(gdal.Dataset):
 
     def GetWorldTmsBorders(self, resolution=None, transform=None):
         """Returns an iterable of TMS tiles that are outside this Dataset."""
-        world_extents = self.GetWorldTmsExtents(resolution=resolution,
-                                                transform=transform)
-        data_extents = self.GetTmsExtents(resolution=resolution,
-                                          transform=transform)
+        if transform is None and resolution in self._tms_borders_extents:
+            world_extents, data_extents = \
+                self._tms_borders_extents[resolution]
+        else:
+            world_extents = self.GetWorldTmsExtents(resolution=resolution,
+                                                    transform=transform)
+            data_extents = self.GetTmsExtents(resolution=resolution,
+                                              transform=transform)
+            if transform is None:
+                self._tms_borders_extents[resolution] = (world_extents,
+                                                         data_extents)
         return (XY(x, y)
                 for x in range(world_extents.lower_left.x,
                                 world_extents.upper_right.x)
@@ -786,6 +786,7 @@ class Dataset(gdal.Dataset):
     def SetLocalSizes(self, xsize, ysize):
         # Write to the local shadow, because we can't edit XSize and YSize
         self._rastersizes = XY(x=xsize, y=ysize)
+        self._tms_borders_extents.clear()
 
 
 class SpatialReference(osr.SpatialReference):
@@ -17,16 +17,14 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from tempfile import NamedTemporaryFile
 
 from .gdal import Dataset, preprocess
 from .renderers import PngRenderer
 from .storages import MbtilesStorage, NestedFileStorage, SimpleFileStorage
-from .vips import TmsPyramid, validate_resolutions
+from .vips import split_concurrency, TmsPyramid, validate_resolutions, VIPS
 
 
 def image_mbtiles(inputfile, outputfile, metadata,
@@ -48,6 +46,9 @@ def image_mbtiles(inputfile, outputfile, metadata,
                                   10: rgba(255, 255, 255, 255)})
             Defaults to no colorization.
     preprocessor: Function to run on the TmsPyramid before slicing.
+                  Without one, slicing only the native resolution streams
+                  inputfile from top to bottom, instead of decoding it all
+                  into memory.
 
     If `min_resolution` is None, don't downsample.
     If `max_resolution` is None, don't upsample.
@@ -66,7 +67,8 @@ def image_mbtiles(inputfile, outputfile, metadata,
         pyramid = TmsPyramid(inputfile=inputfile,
                              storage=storage,
                              min_resolution=min_resolution,
-                             max_resolution=max_resolution)
+                             max_resolution=max_resolution,
+                             sequential=(preprocessor is None))
         if preprocessor is None:
             preprocessor = colorize
 
@@ -89,37 +91,60 @@ def image_mbtiles(inputfile, outputfile, metadata,
 
 def image_pyramid(inputfile, outputdir,
                   min_resolution=None, max_resolution=None, fill_borders=None,
-                  colors=None, renderer=None, preprocessor=None):
+                  colors=None, renderer=None, preprocessor=None, image=None):
     """
     Slices a GDAL-readable inputfile into a pyramid of PNG tiles.
 
     inputfile: Filename
     outputdir: The output directory for the PNG tiles.
+    image: Already decoded pyvips.Image of inputfile, to avoid loading it
+           again. Defaults to loading inputfile.
     min_resolution: Minimum resolution to downsample tiles.
     max_resolution: Maximum resolution to upsample tiles.
     fill_borders: Fill borders of image with empty tiles.
+    renderer: Used to render tiles. Defaults to PNGs at compression level 1,
+              trading slightly larger files for much faster encoding.
     preprocessor: Function to run on the TmsPyramid before slicing.
+                  Without one, slicing only the native resolution streams
+                  inputfile from top to bottom, instead of decoding it all
+                  into memory.
 
     Filenames are in the format ``{tms_z}/{tms_x}/{tms_y}.png``.
 
     If a tile duplicates another tile already known to this process, a symlink
     may be created instead of rendering the same tile to PNG again.
 
+    Tiles are rendered by a pool of threads, sharing the physical CPUs with
+    libvips.
+
     If `min_resolution` is None, don't downsample.
     If `max_resolution` is None, don't upsample.
     """
     if renderer is None:
-        renderer = PngRenderer()
-    storage = NestedFileStorage(outputdir=outputdir,
-                                renderer=renderer)
-    pyramid = TmsPyramid(inputfile=inputfile,
-                         storage=storage,
-                         min_resolution=min_resolution,
-                         max_resolution=max_resolution)
-    if preprocessor is None:
-        preprocessor = colorize
-    pyramid = preprocessor(**locals())
-    pyramid.slice(fill_borders=fill_borders)
+        renderer = PngRenderer(compression=1)
+    render_threads, vips_threads = split_concurrency()
+    with ThreadPoolExecutor(max_workers=render_threads) as pool, \
+            VIPS.concurrency(processes=vips_threads):
+        storage = NestedFileStorage(outputdir=outputdir,
+                                    renderer=renderer,
+                                    pool=pool)
+        pyramid = TmsPyramid(inputfile=inputfile,
+                             storage=storage,
+                             min_resolution=min_resolution,
+                             max_resolution=max_resolution,
+                             sequential=(preprocessor is None),
+                             image=image)
+        if preprocessor is None:
+            preprocessor = colorize
+        # Only the arguments preprocessors have always been given, not the
+        # pool or a pre-decoded image.
+        pyramid = preprocessor(inputfile=inputfile, outputdir=outputdir,
+                               min_resolution=min_resolution,
+                               max_resolution=max_resolution,
+                               fill_borders=fill_borders, colors=colors,
+                               renderer=renderer, preprocessor=preprocessor,
+                               storage=storage, pyramid=pyramid)
+        pyramid.slice(fill_borders=fill_borders)
 
 
 def image_slice(inputfile, outputdir, fill_borders=None,
@@ -134,25 +159,43 @@ def image_slice(inputfile, outputdir, fill_borders=None,
             colors=ColorGradient({0: rgba(0, 0, 0, 255),
                                   10: rgba(255, 255, 255, 255)})
             Defaults to no colorization.
+    renderer: Used to render tiles. Defaults to PNGs at compression level 1,
+              trading slightly larger files for much faster encoding.
     preprocessor: Function to run on the TmsPyramid before slicing.
+                  Without one, slicing only the native resolution streams
+                  inputfile from top to bottom, instead of decoding it all
+                  into memory.
 
     Filenames are in the format ``{tms_z}-{tms_x}-{tms_y}-{image_hash}.png``.
 
     If a tile duplicates another tile already known to this process, a symlink
     is created instead of rendering the same tile to PNG again.
+
+    Tiles are rendered by a pool of threads, sharing the physical CPUs with
+    libvips.
     """
     if renderer is None:
-        renderer = PngRenderer()
-    storage = SimpleFileStorage(outputdir=outputdir,
-                                renderer=renderer)
-    pyramid = TmsPyramid(inputfile=inputfile,
-                         storage=storage,
-                         min_resolution=None,
-                         max_resolution=None)
-    if preprocessor is None:
-        preprocessor = colorize
-    pyramid = preprocessor(**locals())
-    pyramid.slice(fill_borders=fill_borders)
+        renderer = PngRenderer(compression=1)
+    render_threads, vips_threads = split_concurrency()
+    with ThreadPoolExecutor(max_workers=render_threads) as pool, \
+            VIPS.concurrency(processes=vips_threads):
+        storage = SimpleFileStorage(outputdir=outputdir,
+                                    renderer=renderer,
+                                    pool=pool)
+        pyramid = TmsPyramid(inputfile=inputfile,
+                             storage=storage,
+                             min_resolution=None,
+                             max_resolution=None,
+                             sequential=(preprocessor is None))
+        if preprocessor is None:
+            preprocessor = colorize
+        # Only the arguments preprocessors have always been given, not the
+        # pool.
+        pyramid = preprocessor(inputfile=inputfile, outputdir=outputdir,
+                               fill_borders=fill_borders, colors=colors,
+                               renderer=renderer, preprocessor=preprocessor,
+                               storage=storage, pyramid=pyramid)
+        pyramid.slice(fill_borders=fill_borders)
 
 
 def warp_mbtiles(inputfile, outputfile, metadata, colors=None, band=None,
@@ -31,10 +31,6 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
-
 import argparse
 from contextlib import contextmanager
 import logging
@@ -266,8 +262,8 @@ def main(args=None, use_logging=True):
     if use_logging:
         configure_logging(args)
 
-    # HACK: Import here, so that VIPS doesn't parse sys.argv!!!
-    # In vimagemodule.cxx, SWIG_init actually does argument parsing
+    # Import here, so that libvips is only loaded once the arguments have
+    # been parsed successfully.
     from gdal2mbtiles.helpers import warp_mbtiles
 
     with input_output(inputfile=args.INPUT,
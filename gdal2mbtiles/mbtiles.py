@@ -17,25 +17,13 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
+from collections.abc import MutableMapping
 from distutils.version import LooseVersion
 import errno
 import os
 import sqlite3
 from struct import pack, unpack
 
-try:
-     from UserDict import DictMixin
-except ImportError:
-     from collections import MutableMapping
-
-try:
-  basestring
-except NameError:
-  basestring = str
-
 from .gd_types import enum
 from .utils import rmfile
 
@@ -64,18 +52,7 @@ class MetadataValueError(MetadataError, ValueError):
     pass
 
 
-import sys
-if sys.version_info[0] < 3:
-
-    class CompatibleMutableMapping(object, DictMixin):
-        pass
-
-else:
-    class CompatibleMutableMapping(MutableMapping):
-        pass
-
-
-class Metadata(CompatibleMutableMapping):
+class Metadata(MutableMapping):
     """
     Key-value metadata table expressed as a dictionary
     """
@@ -276,7 +253,7 @@ class Metadata_1_1(Metadata_1_0):
         return value
 
     def _clean_bounds(self, value, places=5):
-        if isinstance(value, basestring):
+        if isinstance(value, str):
             left, bottom, right, top = [float(b) for b in value.split(',')]
         else:
             left, bottom, right, top = value
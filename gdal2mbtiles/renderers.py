@@ -17,9 +17,6 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 import os
 from subprocess import check_call
 from tempfile import gettempdir, NamedTemporaryFile
@@ -105,6 +102,10 @@ class PngRenderer(Renderer):
           If an integer, specifies number of colors in palette.
           If True, defaults to 256 colors.
     optimize: Optimizes PNG using optipng. Default False. See `optipng -h`.
+    strip_opaque_alpha: Renders RGBA images that are fully opaque as RGB
+                        PNGs, which are smaller and faster to encode, at the
+                        cost of checking each image's alpha band.
+                        Default False.
     suffix: Suffix for filename. Default '.png'.
 
     If optimize is not False, then compression is ignored and set to 0, to
@@ -117,7 +118,7 @@ class PngRenderer(Renderer):
     OPTIPNG = 'optipng'
 
     def __init__(self, compression=None, interlace=None, png8=None,
-                 optimize=None, **kwargs):
+                 optimize=None, strip_opaque_alpha=None, **kwargs):
         if compression is None:
             compression = 6
         _compression = int(compression)
@@ -157,6 +158,10 @@ class PngRenderer(Renderer):
             self.compression = 1  # Reduce cost of double-compression
         self.optimize = _optimize
 
+        if strip_opaque_alpha is None:
+            strip_opaque_alpha = False
+        self.strip_opaque_alpha = bool(strip_opaque_alpha)
+
         super(PngRenderer, self).__init__(**kwargs)
 
     @property
@@ -168,6 +173,9 @@ class PngRenderer(Renderer):
 
     def render(self, image):
         """Returns the rendered VIPS `image`."""
+        if self.strip_opaque_alpha and image.bands == 4 and \
+           image.format == 'uchar' and image.extract_band(3).min() == 255:
+            image = image.extract_band(0, n=3)
         with NamedTemporaryFile(suffix=self.suffix,
                                 dir=self.tempdir) as rendered:
             image.write_to_file(rendered.name, **self._vips_options)
@@ -17,14 +17,12 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
-import sys
-
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import wait
+import errno
 from functools import partial
 import os
+import shutil
 
 from .constants import TILE_SIDE
 from .gdal import SpatialReference
@@ -34,34 +32,77 @@ from .utils import intmd5, makedirs
 from .vips import VImageAdapter
 
 
-try:
-  basestring
-except NameError:
-  basestring = str
-
-
 class Storage(object):
     """Base class for storages."""
 
-    def __init__(self, renderer, pool=None):
+    # Most tiles waiting on `pool`, each holding on to a tile-sized image.
+    MAX_PENDING = 256
+
+    def __init__(self, renderer, pool=None, hasher=None):
         """
         Initialize a storage.
 
         renderer: Used to render images into tiles.
+        pool: concurrent.futures.Executor to render tiles with. Defaults to
+              rendering them as they are saved.
+        hasher: Function returning the integer hash of a tile's pixels.
+                Defaults to `intmd5`.
         """
         self.renderer = renderer
+        self.pool = pool
+        self._pending = OrderedDict()
 
-        self.hasher = intmd5
+        if hasher is None:
+            hasher = intmd5
+        self.hasher = hasher
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        return
+        if type is None:
+            self.waitall()
+        else:
+            # Don't hide the original exception behind a rendering error.
+            self.cancelall()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on self.pool, or right away if there is none.
+
+        key: Identifies the work for `wait`.
+        """
+        if self.pool is None:
+            fn(*args, **kwargs)
+            return
+        while len(self._pending) >= self.MAX_PENDING:
+            _, future = self._pending.popitem(last=False)
+            future.result()
+        self._pending[key] = self.pool.submit(fn, *args, **kwargs)
+
+    def wait(self, key):
+        """Waits for the work submitted as `key` to finish."""
+        future = self._pending.pop(key, None)
+        if future is not None:
+            future.result()
+
+    def waitall(self):
+        """Waits for all submitted work to finish, raising its errors."""
+        while self._pending:
+            _, future = self._pending.popitem(last=False)
+            future.result()
+
+    def cancelall(self):
+        """Cancels submitted work, waiting for any already running to stop."""
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future in pending:
+            future.cancel()
+        wait(pending)
 
     def get_hash(self, image):
         """Returns the image content hash."""
-        return self.hasher(image.write_to_memory())
+        return self.hasher(VImageAdapter(image).buffer())
 
     def filepath(self, x, y, z, hashed):
         """Returns the filepath."""
@@ -71,8 +112,12 @@ class Storage(object):
         """Runs after `pyramid` has finished importing into this storage."""
         pass
 
-    def save(self, x, y, z, image):
-        """Saves `image` at coordinates `x`, `y`, and `z`."""
+    def save(self, x, y, z, image, hashed=None):
+        """
+        Saves `image` at coordinates `x`, `y`, and `z`.
+
+        hashed: Content hash of `image`, if already known.
+        """
         raise NotImplementedError()
 
     def save_border(self, x, y, z):
@@ -82,11 +127,9 @@ class Storage(object):
     @classmethod
     def _border_image(cls, width=TILE_SIDE, height=TILE_SIDE):
         """Returns a border image suitable for borders."""
-        image = VImageAdapter.new_rgba(
+        return VImageAdapter.new_rgba(
             width, height, ink=rgba(r=0, g=0, b=0, a=0)
         )
-        image._buf = image
-        return image
 
 
 class SimpleFileStorage(Storage):
@@ -94,19 +137,22 @@ class SimpleFileStorage(Storage):
     Saves tiles in `outputdir` as 'z-x-y-hash.ext'.
     """
 
-    def __init__(self, renderer, outputdir, seen=None, **kwargs):
+    def __init__(self, renderer, outputdir, seen=None, hardlinks=False,
+                 **kwargs):
         """
         Initializes storage.
 
         renderer: Used to render images into tiles.
         outputdir: Output directory for tiles
-        pool: Process pool to coordinate subprocesses.
+        hardlinks: Duplicate tiles are hardlinked instead of symlinked.
+        pool: Executor to render tiles with.
         """
         super(SimpleFileStorage, self).__init__(renderer=renderer,
                                                 **kwargs)
         if seen is None:
             seen = {}
         self.seen = seen
+        self.hardlinks = hardlinks
         self._border_hashed = None
 
         self.outputdir = outputdir
@@ -117,18 +163,52 @@ class SimpleFileStorage(Storage):
         return ('{z}-{x}-{y}-{hashed:x}'.format(**locals()) +
                 self.renderer.suffix)
 
-    def save(self, x, y, z, image):
-        """Saves `image` at coordinates `x`, `y`, and `z`."""
-        hashed = self.get_hash(image)
+    def save(self, x, y, z, image, hashed=None):
+        """
+        Saves `image` at coordinates `x`, `y`, and `z`.
+
+        hashed: Content hash of `image`, if already known.
+        """
+        if hashed is None:
+            hashed = self.get_hash(image)
         filepath = self.filepath(x=x, y=y, z=z, hashed=hashed)
         if hashed in self.seen:
-            self.symlink(src=self.seen[hashed], dst=filepath)
+            self.dedup_link(src=self.seen[hashed], dst=filepath)
         else:
             self.seen[hashed] = filepath
-            contents = self.renderer.render(image)
-            outputfile = os.path.join(self.outputdir, filepath)
-            with open(outputfile, 'wb') as output:
-                output.write(contents)
+            self.submit(filepath, self._write, image=image, filepath=filepath)
+
+    def _write(self, image, filepath):
+        """Renders `image` to `filepath`, relative to self.outputdir."""
+        contents = self.renderer.render(image)
+        outputfile = os.path.join(self.outputdir, filepath)
+        with open(outputfile, 'wb') as output:
+            output.write(contents)
+
+    def dedup_link(self, src, dst):
+        """Makes dst a duplicate of the tile already saved at src."""
+        if self.hardlinks:
+            self.hardlink(src=src, dst=dst)
+        else:
+            self.symlink(src=src, dst=dst)
+
+    def hardlink(self, src, dst):
+        """
+        Creates a hardlink from dst to src.
+
+        If src cannot be hardlinked, for example because dst is on another
+        filesystem, it is copied instead.
+        """
+        absdst = os.path.join(self.outputdir, dst)
+        abssrc = os.path.join(self.outputdir, src)
+        self.wait(src)          # src may still be rendering
+        try:
+            os.link(abssrc, absdst)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            # Uses os.sendfile where the platform supports it.
+            shutil.copyfile(abssrc, absdst)
 
     def symlink(self, src, dst):
         """Creates a relative symlink from dst to src."""
@@ -143,11 +223,11 @@ class SimpleFileStorage(Storage):
         if self._border_hashed is None or self._border_hashed not in self.seen:
             image = self._border_image()
             self._border_hashed = self.get_hash(image)
-            self.save(x=x, y=y, z=z, image=image)
+            self.save(x=x, y=y, z=z, image=image, hashed=self._border_hashed)
         else:
             # self._border_hashed will already be in self.seen
             filepath = self.filepath(x=x, y=y, z=z, hashed=self._border_hashed)
-            self.symlink(src=self.seen[self._border_hashed], dst=filepath)
+            self.dedup_link(src=self.seen[self._border_hashed], dst=filepath)
 
 
 class NestedFileStorage(SimpleFileStorage):
@@ -161,7 +241,7 @@ class NestedFileStorage(SimpleFileStorage):
 
         renderer: Used to render images into tiles.
         outputdir: Output directory for tiles
-        pool: Process pool to coordinate subprocesses.
+        pool: Executor to render tiles with.
         """
         super(NestedFileStorage, self).__init__(renderer=renderer,
                                                 **kwargs)
@@ -178,10 +258,15 @@ class NestedFileStorage(SimpleFileStorage):
                      ignore_exists=True)
             self.madedirs[z][x] = True
 
-    def save(self, x, y, z, image):
-        """Saves `image` at coordinates `x`, `y`, and `z`."""
+    def save(self, x, y, z, image, hashed=None):
+        """
+        Saves `image` at coordinates `x`, `y`, and `z`.
+
+        hashed: Content hash of `image`, if already known.
+        """
         self.makedirs(x=x, y=y, z=z)
-        return super(NestedFileStorage, self).save(x=x, y=y, z=z, image=image)
+        return super(NestedFileStorage, self).save(x=x, y=y, z=z, image=image,
+                                                   hashed=hashed)
 
     def save_border(self, x, y, z):
         """Saves a border image at coordinates `x`, `y`, and `z`."""
@@ -202,7 +287,8 @@ class MbtilesStorage(Storage):
 
         renderer: Used to render images into tiles.
         filename: Name of the MBTiles file.
-        pool: Process pool to coordinate subprocesses.
+        pool: Unused. Tiles are rendered as they are saved, because the
+              SQLite connection cannot be shared between threads.
         """
         super(MbtilesStorage, self).__init__(renderer=renderer,
                                              **kwargs)
@@ -217,7 +303,7 @@ class MbtilesStorage(Storage):
 
         self.mbtiles = None
 
-        if isinstance(filename, basestring):
+        if isinstance(filename, str):
             self.filename = filename
             self.mbtiles = MBTiles(filename=filename)
         else:
@@ -244,7 +330,6 @@ class MbtilesStorage(Storage):
         zoom_offset: Offset zoom level.
 
         version: Optional MBTiles version.
-        pool: Process pool to coordinate subprocesses.
 
         Metadata is also taken as **kwargs. See `mbtiles.Metadata`.
         """
@@ -271,9 +356,14 @@ class MbtilesStorage(Storage):
         self.mbtiles.metadata['bounds'] = (lower_left.x, lower_left.y,
                                            upper_right.x, upper_right.y)
 
-    def save(self, x, y, z, image):
-        """Saves `image` at coordinates `x`, `y`, and `z`."""
-        hashed = self.get_hash(image)
+    def save(self, x, y, z, image, hashed=None):
+        """
+        Saves `image` at coordinates `x`, `y`, and `z`.
+
+        hashed: Content hash of `image`, if already known.
+        """
+        if hashed is None:
+            hashed = self.get_hash(image)
         if hashed in self.seen:
             self.mbtiles.insert(x=x, y=y,
                                 z=z + self.zoom_offset,
@@ -281,21 +371,17 @@ class MbtilesStorage(Storage):
         else:
             self.seen.add(hashed)
             contents = self.renderer.render(image)
-            if sys.version_info < (3, 0):
-                data = buffer(contents)
-            else:
-                data = memoryview(contents)
             self.mbtiles.insert(x=x, y=y,
                                 z=z + self.zoom_offset,
                                 hashed=hashed,
-                                data=data)
+                                data=memoryview(contents))
 
     def save_border(self, x, y, z):
         """Saves a border image at coordinates `x`, `y`, and `z`."""
         if self._border_hashed is None:
             image = self._border_image()
-            self.save(x=x, y=y, z=z, image=image)
             self._border_hashed = self.get_hash(image)
+            self.save(x=x, y=y, z=z, image=image, hashed=self._border_hashed)
         else:
             # self._border_hashed will already be inserted
             self.mbtiles.insert(x=x, y=y,
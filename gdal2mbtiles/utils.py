@@ -17,12 +17,9 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 from contextlib import contextmanager
 import errno
-from hashlib import md5
+from hashlib import md5, sha1
 import os
 from shutil import rmtree
 from tempfile import mkdtemp
@@ -42,8 +39,10 @@ def tempenv(name, value):
 @contextmanager
 def NamedTemporaryDir(**kwargs):
     dirname = mkdtemp(**kwargs)
-    yield dirname
-    rmtree(dirname, ignore_errors=True)
+    try:
+        yield dirname
+    finally:
+        rmtree(dirname, ignore_errors=True)
 
 
 def makedirs(d, ignore_exists=False):
@@ -67,17 +66,37 @@ def rmfile(path, ignore_missing=False):
 
 
 def recursive_listdir(directory):
-    """Generator of all files in `directory`, recursively."""
-    for root, dirs, files in os.walk(directory):
-        root = os.path.relpath(root, directory)
-        if root == '.':
-            root = ''
-        for d in dirs:
-            yield os.path.join(root, d) + os.path.sep
-        for f in files:
-            yield os.path.join(root, f)
+    """
+    Generator of all files in `directory`, recursively.
+
+    Directories end with a path separator. Symlinks are listed as files, and
+    are not followed.
+    """
+    stack = ['']
+    while stack:
+        root = stack.pop()
+        # Read each directory in full before yielding, so that its handle is
+        # closed even if the caller stops early. Python 3.5's os.scandir
+        # can't be used in a with statement.
+        for entry in list(os.scandir(os.path.join(directory, root))):
+            path = os.path.join(root, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                yield path + os.path.sep
+                stack.append(path)
+            else:
+                yield path
 
 
 def intmd5(x):
     """Returns the MD5 digest of `x` as an integer."""
-    return int(md5(x).hexdigest(), base=16)
+    return int.from_bytes(md5(x).digest(), 'big')
+
+
+def inthash(x):
+    """
+    Returns the first 128 bits of the SHA-1 digest of `x` as an integer.
+
+    Faster than `intmd5`, since OpenSSL uses the SHA extensions of modern
+    CPUs, but tile hashes differ from those of earlier releases.
+    """
+    return int.from_bytes(sha1(x).digest()[:16], 'big')
@@ -17,17 +17,14 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 import os
 
 from contextlib import contextmanager
-from ctypes import c_double, c_int, c_void_p, cdll
+from ctypes import c_void_p, cdll
 from ctypes.util import find_library
 from itertools import groupby
 import logging
-from math import ceil, floor
+from math import ceil, floor, isfinite
 from multiprocessing import cpu_count
 from operator import itemgetter
 
@@ -39,13 +36,13 @@ from .gdal import Dataset, Band
 from .gd_types import rgba, XY
 from .utils import tempenv
 
-from pyvips import Image, Interpolate
+from pyvips import Image, Interpolate, vips_lib
 from pyvips.enums import BandFormat, Coding
 
 try:
-  basestring
-except NameError:
-  basestring = str
+    import psutil
+except ImportError:
+    psutil = None
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -76,16 +73,65 @@ class LibTiff(object):
 TIFF = LibTiff()
 
 
+def physical_cpu_count():
+    """
+    Returns the number of physical CPU cores available to this process.
+
+    This needs psutil, from the 'psutil' extra. Without it, this is only the
+    number of CPUs in this process's affinity mask, counting hyperthreads.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = cpu_count()
+    physical = psutil.cpu_count(logical=False) if psutil is not None else None
+    if physical:
+        return min(physical, available)
+    return available
+
+
+def default_concurrency():
+    """
+    Returns the total number of threads to slice with.
+
+    Shrinking and encoding are memory-bound, so hyperthreads don't help and
+    this defaults to `physical_cpu_count`. GDAL2MBTILES_CONCURRENCY
+    overrides it; invalid values are ignored with a warning.
+    """
+    value = os.environ.get('GDAL2MBTILES_CONCURRENCY', None)
+    if value is not None:
+        try:
+            threads = int(value)
+        except ValueError:
+            threads = 0
+        if threads >= 1:
+            return threads
+        logger.warning(
+            'Ignoring invalid GDAL2MBTILES_CONCURRENCY: {0!r}'.format(value)
+        )
+    return physical_cpu_count()
+
+
+def split_concurrency(threads=None):
+    """
+    Returns (render threads, libvips threads) that add up to `threads`.
+
+    Tiles are rendered on a pool while libvips computes the next strips, so
+    the two are sized together. `threads` defaults to `default_concurrency`.
+    """
+    if threads is None:
+        threads = default_concurrency()
+    render = max(1, threads // 2)
+    return render, max(1, threads - render)
+
+
 class LibVips(object):
     """Wrapper object around C library."""
 
-    def __init__(self, version=None):
-        if version is not None:
-            library = 'libvips.so.{0:d}'.format(version)
-        else:
-            library = find_library('vips')
-        self.libvips = cdll.LoadLibrary(library)
-        self.functions = {}
+    def __init__(self):
+        # Reuse the library handle that pyvips has already opened, so that
+        # calls go through its cached cffi declarations.
+        self.libvips = vips_lib
 
     @classmethod
     def disable_warnings(cls):
@@ -94,7 +140,7 @@ class LibVips(object):
 
     def get_concurrency(self):
         """Returns the number of threads used for computations."""
-        return c_int.in_dll(self.libvips, 'vips__concurrency').value
+        return self.libvips.vips_concurrency_get()
 
     def set_concurrency(self, processes):
         """Sets the number of threads used for computations."""
@@ -104,18 +150,36 @@ class LibVips(object):
                     processes
                 )
             )
+        self.libvips.vips_concurrency_set(processes)
+
+    @contextmanager
+    def concurrency(self, processes):
+        """
+        Context manager to use `processes` threads for computations.
 
-        vips_concurrency_set = self.functions.get('vips_concurrency_set', None)
-        if vips_concurrency_set is None:
-            vips_concurrency_set = self.libvips.vips_concurrency_set
-            vips_concurrency_set.argtypes = [c_int]
-            vips_concurrency_set.restype = None
-            self.functions['vips_concurrency_set'] = vips_concurrency_set
-        vips_concurrency_set(processes)
+        Leaves concurrency to libvips if VIPS_CONCURRENCY is set.
+        """
+        if 'VIPS_CONCURRENCY' in os.environ:
+            yield
+            return
+        original = self.get_concurrency()
+        self.set_concurrency(processes=processes)
+        try:
+            yield
+        finally:
+            self.set_concurrency(processes=original)
 
 VIPS = LibVips()
 
 
+def _is_power_of_two(x):
+    """Returns True if `x` is a whole power of two, like 1, 2, 4, 8."""
+    if not float(x).is_integer():
+        return False
+    n = int(x)
+    return n > 0 and n & (n - 1) == 0
+
+
 class VImageAdapter(object):
     """
     Class to prvovide some additional methods to manipulate a pyvips.Image
@@ -142,42 +206,22 @@ class VImageAdapter(object):
         BandFormat.DPCOMPLEX: numpy.complex128,
     }
 
-    def __init__(self, image, *args, **kwargs):
+    def __init__(self, image):
         # image: a pyvips.Image object
         self.image = image
-        if VIPS.get_concurrency() == 0:
-            # Override auto-detection from environ and argv.
-            VIPS.set_concurrency(processes=cpu_count())
-        args = [a.encode('utf-8') if isinstance(a, str) else a
-                for a in args]
-        with TIFF.disable_warnings():
-            super(VImageAdapter, self).__init__(*args, **kwargs)
 
     @classmethod
     def new_rgba(cls, width, height, ink=None):
         """Creates a new transparent RGBA image sized width × height."""
-        # Creating a placeholder image with new_from_memory (equivalent of the
-        # old vipsCC frombuffer) creates an image
-        # which is a few byes different when written back to memory, which means
-        # we can't store and retrieve it from its hash.  So instead we use a
-        # temporary transparent 256x256 file for the initial image
-        image = Image.new_from_file(
-            os.path.join(
-                os.path.dirname(os.path.realpath(__file__)), 'default_rgba.png'
-            )
-        )
-        image = image.copy(
-            width=width, height=height,
-            coding='none',  # No coding and no compression
+        # Constant images are lazy: nothing is allocated until the pixels
+        # are consumed.
+        image = Image.black(width, height, bands=4).cast(BandFormat.UCHAR)
+        if ink is not None:
+            image = image.new_from_image([ink.r, ink.g, ink.b, ink.a])
+        return image.copy(
             interpretation='srgb',
             xres=2.835, yres=2.835,  # Arbitrary 600 dpi
-            xoffset=0, yoffset=0  # Working buffer
         )
-        if ink is not None:
-            image.draw_rect(
-                [ink.r, ink.g, ink.b, ink.a], 0, 0, width, height, fill=True
-            )
-        return image
 
     @classmethod
     def from_gdal_dataset(cls, dataset, band):
@@ -199,12 +243,10 @@ class VImageAdapter(object):
             if VImageAdapter(image2).NumPyType() == datatype:
                 return image2
             types = dict((v, k) for k, v in cls.NUMPY_TYPES.items())
-            image3 = Image.new_from_memory(image2.write_to_memory(),
-                                           width=image2.width,
-                                           height=image2.height,
-                                           bands=1, format=types[datatype])
-            image3._buf = image2
-            return image3
+            return Image.new_from_memory(image2.write_to_memory(),
+                                         width=image2.width,
+                                         height=image2.height,
+                                         bands=1, format=types[datatype])
 
     @classmethod
     def from_numpy_array(cls, array, width, height, bands, format):
@@ -242,7 +284,7 @@ class VImageAdapter(object):
     @classmethod
     def get_fill_option(cls, fill):
         # TODO get rid of this?  No option to pass the fill colour
-        if isinstance(fill, basestring):
+        if isinstance(fill, str):
             if fill not in cls.FILL_OPTIONS:
                 raise cls('Invalid fill: {0!r}'.format(fill))
             return cls.FILL_OPTIONS[fill]
@@ -267,22 +309,13 @@ class VImageAdapter(object):
                 )
             )
 
-        # Link output to self, because its buffer is related to self.image()
-        # We don't want self to get destructed in C++ when Python garbage
-        # collects self if it falls out of scope.
-
-        image = self.image.affine(
+        return self.image.affine(
             [a, b, c, d],
             interpolate=interpolate,
             oarea=[ox, oy, ow, oh],
             odx=dx, ody=dy,
             idx=0, idy=0
         )
-        image.__inputref = self.image
-        # output = VIPS.im_affinei(self.image, self.image.copy(), interpolate,
-        #                 a, b, c, d, dx, dy, ox, oy, ow, oh)
-
-        return image
 
     def _scale(self, xscale, yscale, output_size, interpolate):
         """
@@ -343,6 +376,10 @@ class VImageAdapter(object):
         # No translation, so top-left corners match.
         output_x, output_y = 0, 0
 
+        # libvips interpolates at a higher precision internally, but rounds
+        # the result back to the input's band format, so a uchar image stays
+        # uchar rather than being promoted to float.
+
         return self.affine(a=a, b=b, c=c, d=d, dx=offset_x, dy=offset_y,
                            ox=output_x, oy=output_y,
                            ow=output_width, oh=output_height,
@@ -371,6 +408,28 @@ class VImageAdapter(object):
             xscale=xscale, yscale=yscale, output_size=output_size, interpolate='bilinear'
         )
 
+    def shrink(self, xscale, yscale, output_size=None):
+        """
+        Returns a new pyvips.Image that has been shrunk by `xscale` and `yscale`.
+
+        xscale: floating point scaling value for image
+        yscale: floating point scaling value for image
+        output_size: output width and height in pixels (tuple)
+
+        When the image divides exactly by integer shrink factors, this uses
+        libvips' box filter, which is much cheaper than interpolating every
+        pixel. Otherwise, this falls back to `shrink_affine`.
+        """
+        if 0.0 < xscale <= 1.0 and 0.0 < yscale <= 1.0:
+            xshrink, yshrink = 1.0 / xscale, 1.0 / yscale
+            width, height = self.image.width, self.image.height
+            if xshrink.is_integer() and yshrink.is_integer() and \
+               width % xshrink == 0 and height % yshrink == 0 and \
+               output_size in (None, (width // xshrink, height // yshrink)):
+                return self.image.shrink(xshrink, yshrink)
+        return self.shrink_affine(xscale=xscale, yscale=yscale,
+                                  output_size=output_size)
+
     def stretch(self, xscale, yscale, output_size=None):
         """
         Returns a new pyvips.Image that has been stretched by `xscale` and `yscale`.
@@ -379,14 +438,22 @@ class VImageAdapter(object):
         yscale: floating point scaling value for image
         output_size: output width and height in pixels (tuple)
         """
-        if xscale < 1.0:
+        if not isfinite(xscale) or xscale < 1.0:
             raise ValueError(
-                'xscale {0!r} cannot be less than 1.0'.format(xscale)
+                'xscale {0!r} must be finite and at least 1.0'.format(xscale)
             )
-        if yscale < 1.0:
+        if not isfinite(yscale) or yscale < 1.0:
             raise ValueError(
-                'yscale {0!r} cannot be less than 1.0'.format(yscale)
+                'yscale {0!r} must be finite and at least 1.0'.format(yscale)
             )
+        if _is_power_of_two(xscale) and _is_power_of_two(yscale):
+            # Nearest-neighbour at a power-of-two scale repeats each pixel,
+            # which libvips' zoom does without interpolating. Other factors
+            # sample the corner-aligned grid at different pixels.
+            xfac, yfac = int(xscale), int(yscale)
+            width, height = self.image.width, self.image.height
+            if output_size in (None, (width * xfac, height * yfac)):
+                return self.image.zoom(xfac, yfac)
         return self._scale(
             xscale=xscale, yscale=yscale, output_size=output_size,
             interpolate='near'
@@ -402,23 +469,28 @@ class VImageAdapter(object):
 
         returns a new Image object
         """
+        image_width, image_height = self.image.width, self.image.height
+
         # Pixel offset from top-left of the aligned image.
         #
         # The y value needs to be converted from the lower-left corner to the
         # top-left corner.
         x = int(round(offset.x * tile_width)) % tile_width
-        y = int(round(self.image.height - offset.y * tile_height)) % tile_height
+        y = int(round(image_height - offset.y * tile_height)) % tile_height
 
         # Number of tiles for the aligned image, rounded up to provide
-        # right and bottom borders.
-        tiles_x = ceil((self.image.width + x / 2) / tile_width)
-        tiles_y = ceil((self.image.height + y / 2) / tile_height)
+        # right and bottom borders. This is ceil((width + x / 2) / tile_width)
+        # in exact integer arithmetic.
+        tiles_x = ((2 * image_width + x + 2 * tile_width - 1) //
+                   (2 * tile_width))
+        tiles_y = ((2 * image_height + y + 2 * tile_height - 1) //
+                   (2 * tile_height))
 
         # Pixel width and height for the aligned image.
-        width = int(tiles_x * tile_width)
-        height = int(tiles_y * tile_height)
+        width = tiles_x * tile_width
+        height = tiles_y * tile_height
 
-        if width == self.image.width and height == self.image.height:
+        if width == image_width and height == image_height:
             # No change
             assert x == y == 0
             return self.image
@@ -428,6 +500,15 @@ class VImageAdapter(object):
             x, y, width, height, background=[0, 0, 0, 0]  # Transparent
         )
 
+    def buffer(self):
+        """
+        Returns a memoryview of the rendered pixels.
+
+        The memory is allocated by libvips, and is not copied into a Python
+        bytes object.
+        """
+        return memoryview(self.image.write_to_memory())
+
     def BufferSize(self):
         """Return the size of the buffer in bytes if it were rendered."""
         data_size = self.NumPyType().itemsize
@@ -437,10 +518,9 @@ class VImageAdapter(object):
         """Return an instance of the NumPy data type."""
         return self.NUMPY_TYPES[self.image.format]()
 
-    def write(self, *args):
-        args = [a.encode('utf-8') if isinstance(a, str) else a
-                for a in args]
-        return self.image.write(*args)
+    def write(self, other):
+        """Writes this image into `other`, a pyvips.Image."""
+        return self.image.write(other)
 
 
 class VipsBand(Band):
@@ -486,7 +566,7 @@ class VipsBand(Band):
         area = band.extract_area(xoff, yoff, win_xsize, win_ysize)
 
         return numpy.ndarray(shape=(win_xsize, win_ysize),
-                             buffer=area.write_to_memory(),
+                             buffer=VImageAdapter(area).buffer(),
                              dtype=VImageAdapter(band).NumPyType()).copy()
 
     # The next methods are there to prevent you from shooting yourself in the
@@ -503,21 +583,59 @@ class VipsBand(Band):
 
 
 class VipsDataset(Dataset):
-    def __init__(self, inputfile, *args, **kwargs):
+    # Loaders that can shrink an image by 2, 4 or 8 while decoding it.
+    SHRINK_ON_LOAD_LOADERS = frozenset(['jpegload'])
+
+    def __init__(self, inputfile, *args, image=None, access=None, **kwargs):
         """
-        Opens a GDAL-readable file and holds a VImage for scaling and aligning.
+        Opens a GDAL-readable file and holds a pyvips.Image for scaling and
+        aligning.
+
+        image: Already decoded pixels of inputfile, so that they aren't
+               loaded again. Defaults to loading inputfile on first use.
+        access: VIPS access pattern for loading inputfile: 'random' or
+                'sequential'. Only read top to bottom, once, if
+                'sequential'. Default 'random'.
         """
         super(VipsDataset, self).__init__(inputfile, *args, **kwargs)
 
+        if access is None:
+            access = 'random'
+        if access not in ('random', 'sequential'):
+            raise ValueError(
+                'access must be random or sequential: {0!r}'.format(access)
+            )
+
         self.inputfile = inputfile
-        self._image = None
+        self.access = access
+        self._image = image
+        self._loaded_image = None
 
     @property
     def image(self):
         if self._image is None:
-            self._image = Image.new_from_file(self.inputfile)
+            self._image = Image.new_from_file(self.inputfile,
+                                              access=self.access)
+            self._loaded_image = self._image
         return self._image
 
+    def load_shrunk(self, shrink):
+        """
+        Returns inputfile decoded at 1/`shrink` of its size, or None.
+
+        Some decoders, like libjpeg, shrink the image much faster than
+        decoding it in full and shrinking it afterwards, though not with a
+        box filter. None is returned if the decoder cannot, or if self.image
+        has since been modified.
+        """
+        image = self.image
+        if image is not self._loaded_image or \
+           not image.get_typeof('vips-loader') or \
+           image.get('vips-loader') not in self.SHRINK_ON_LOAD_LOADERS:
+            return None
+        return Image.new_from_file(self.inputfile, access=self.access,
+                                   shrink=shrink)
+
     def GetRasterBand(self, i):
         return VipsBand(band=super(VipsDataset, self).GetRasterBand(i),
                         dataset=self, band_no=(i - 1))
@@ -542,7 +660,7 @@ class VipsDataset(Dataset):
         datatype = self.GetRasterBand(1).NumPyDataType
 
         return numpy.ndarray(shape=(self.RasterCount, ysize, xsize),
-                             buffer=bytes(area.write_to_memory()),
+                             buffer=VImageAdapter(area).buffer(),
                              dtype=datatype)
 
     def colorize(self, colors):
@@ -733,11 +851,12 @@ class TmsTiles(object):
     IMAGE_BUFFER_INTERVAL = 4
     IMAGE_BUFFER_MEMORY_THRESHOLD = 1024 ** 2  # 1 MiB
     IMAGE_BUFFER_DISK_THRESHOLD = 1024 ** 3    # 1 GiB
+    STRIP_BUFFER_MEMORY_THRESHOLD = 256 * 1024 ** 2  # 256 MiB
 
     def __init__(self, image, storage, tile_width, tile_height, offset,
                  resolution):
         """
-        image: gdal2mbtiles.vips.VImage
+        image: pyvips.Image
         storage: Storage for rendered tiles
         tile_width: Number of pixels for each tile
         tile_height: Number of pixels for each tile
@@ -754,37 +873,75 @@ class TmsTiles(object):
         # Used to determine whether this TmsTiles is backed by a buffer.
         self._parent = None
 
+        # Each pyvips property read is a call into libvips, so the size is
+        # read once. Downsampling and upsampling return new TmsTiles rather
+        # than replacing self.image.
+        self._size = XY(x=image.width, y=image.height)
+
     @property
     def image_width(self):
         """Returns the width of self.image in pixels."""
-        return self.image.width
+        return self._size.x
 
     @property
     def image_height(self):
         """Returns the height of self.image in pixels."""
-        return self.image.height
+        return self._size.y
 
     def fill_borders(self, borders, resolution):
         for x, y in borders:
             self.storage.save_border(x=x, y=y, z=resolution)
 
+    def _render_strip(self, y):
+        """
+        Returns the row of tiles whose top edge is at pixel `y`.
+
+        The row is rendered to memory in one pass of libvips' threadpool, so
+        that each tile is then read from memory, rather than re-evaluating
+        the image pipeline once for its hash and again for its rendering.
+        """
+        strip = self.image.extract_area(0, y,
+                                        self.image_width, self.tile_height)
+        if VImageAdapter(strip).BufferSize() >= \
+           self.STRIP_BUFFER_MEMORY_THRESHOLD:
+            # Too wide to hold in memory, so tiles are evaluated one by one.
+            return strip
+        return strip.copy_memory()
+
+    def tile_indices(self):
+        """
+        Returns (xs, ys) arrays locating every tile of this image.
+
+        Each row of xs is the (pixel offset, TMS x) of a column of tiles, from
+        the left. Each row of ys is the (pixel offset, TMS y) of a row of
+        tiles, from the top.
+        """
+        xs = numpy.arange(0, self.image_width, self.tile_width)
+        ys = numpy.arange(0, self.image_height, self.tile_height)
+        tms_xs = (xs / self.tile_width + self.offset.x).astype(numpy.int64)
+        tms_ys = ((self.image_height - ys) / self.tile_height +
+                  self.offset.y - 1).astype(numpy.int64)
+        return (numpy.column_stack((xs, tms_xs)),
+                numpy.column_stack((ys, tms_ys)))
+
     def _slice(self):
         """Helper function that actually slices tiles. See ``slice``."""
+        xs, ys = self.tile_indices()
+        xs, ys = xs.tolist(), ys.tolist()
+
         with LibVips.disable_warnings():
-            xys = []
-            for y in range(0, self.image_height, self.tile_height):
-                for x in range(0, self.image_width, self.tile_width):
-                    out = self.image.extract_area(
-                        x, y,                    # left, top offsets
+            for y, tms_y in ys:
+                strip = self._render_strip(y=y)
+                for x, tms_x in xs:
+                    # Copy the tile out, so that tiles waiting to be rendered
+                    # don't keep whole strips alive, and so that a lazy strip
+                    # is evaluated here, from top to bottom, rather than on
+                    # the storage's pool.
+                    out = strip.extract_area(
+                        x, 0,                    # left, top offsets
                         self.tile_width, self.tile_height
-                    )
-                    offset = XY(
-                        x=int(x / self.tile_width + self.offset.x),
-                        y=int((self.image_height - y) / self.tile_height +
-                              self.offset.y - 1)
-                    )
-                    xys.append((x, y))
-                    self.storage.save(x=offset.x, y=offset.y,
+                    ).copy_memory()
+                    self.storage.save(x=tms_x, y=tms_y,
                                       z=self.resolution,
                                       image=out)
 
@@ -828,11 +985,20 @@ class TmsTiles(object):
         parent_size = VImageAdapter(parent.image).BufferSize()
 
         for res in reversed(list(range(self.resolution - levels, self.resolution))):
+            # The shrink and the padding are lazy operations, so VIPS
+            # evaluates them together when a region is demanded.
             offset /= 2.0
-            shrunk = VImageAdapter(image).shrink_affine(xscale=0.5, yscale=0.5)
-            image = VImageAdapter(shrunk).tms_align(tile_width=self.tile_width,
-                                     tile_height=self.tile_height,
-                                     offset=offset)
+            shrunk = VImageAdapter(image).shrink(xscale=0.5, yscale=0.5)
+            if shrunk.format != image.format:
+                # Never carry a wider band format down the pyramid: each
+                # level would move several times the bytes for the same
+                # tiles.
+                shrunk = shrunk.cast(image.format)
+            image = VImageAdapter(shrunk).tms_align(
+                tile_width=self.tile_width,
+                tile_height=self.tile_height,
+                offset=offset
+            )
             offset = offset.floor()
 
             # Render to a temporary buffer every IMAGE_BUFFER_INTERVAL levels
@@ -902,16 +1068,14 @@ class TmsTiles(object):
                 'Buffering resolution {0} to disk'.format(resolution)
             )
             vipsfile = Image.new_temp_file("%s.v")
-            tempfile_image = image.write(vipsfile)
-            return tempfile_image
+            image.write(vipsfile)
+            return vipsfile
 
         logger.debug(
             'Buffering resolution {0} to memory'.format(resolution)
         )
-        return Image.new_from_memory(
-            image.write_to_memory(), image.width, image.height, image.bands,
-            'uchar'
-        )
+        # Rendered into memory owned by VIPS, without a copy through Python.
+        return image.copy_memory()
 
 
 class TmsPyramid(object):
@@ -919,15 +1083,29 @@ class TmsPyramid(object):
 
     TmsTiles = TmsTiles
 
+    # Most levels that a decoder can shrink an image by, while loading it.
+    SHRINK_ON_LOAD_LEVELS = 3
+
     def __init__(self, inputfile, storage,
-                 min_resolution=None, max_resolution=None):
+                 min_resolution=None, max_resolution=None, sequential=False,
+                 image=None, shrink_on_load=False):
         """
         Represents a pyramid of PNG tiles.
 
         inputfile: Filename
+        image: Already decoded pyvips.Image of inputfile. Defaults to loading
+               inputfile.
         storage: Storage for rendered tiles
         min_resolution: Minimum resolution to downsample tiles.
         max_resolution: Maximum resolution to upsample tiles.
+        sequential: Stream inputfile from top to bottom, instead of keeping
+                    it all decoded, when only the native resolution is
+                    sliced. Default False.
+        shrink_on_load: When the native resolution isn't sliced, let decoders
+                        such as libjpeg shrink inputfile while loading it.
+                        This is much faster, but their filters differ from
+                        the box filter used otherwise, so tiles at the same
+                        zoom may differ with `max_resolution`. Default False.
 
         Filenames are in the format `{tms_z}/{tms_x}-{tms_y}-{image_hash}.png`.
 
@@ -941,6 +1119,9 @@ class TmsPyramid(object):
         self.storage = storage
         self.min_resolution = min_resolution
         self.max_resolution = max_resolution
+        self.sequential = sequential
+        self.shrink_on_load = shrink_on_load
+        self._inputimage = image
 
         self._dataset = None
         self._resolution = None
@@ -952,9 +1133,28 @@ class TmsPyramid(object):
     @property
     def dataset(self):
         if self._dataset is None:
-            self._dataset = VipsDataset(self.inputfile)
+            self._dataset = VipsDataset(self.inputfile,
+                                        image=self._inputimage,
+                                        access=self._access())
         return self._dataset
 
+    def _access(self):
+        """Returns the VIPS access pattern to load inputfile with."""
+        if not self.sequential or self._inputimage is not None:
+            return 'random'
+        # The input is read once, from top to bottom, only when the native
+        # resolution alone is sliced. Shrinking and stretching read it out
+        # of order.
+        resolutions = set([self.min_resolution,
+                           self.max_resolution]) - set([None])
+        if not resolutions:
+            return 'sequential'
+        if len(resolutions) > 1:
+            return 'random'
+        if resolutions == set([Dataset(self.inputfile).GetNativeResolution()]):
+            return 'sequential'
+        return 'random'
+
     @property
     def image(self):
         return self.dataset.image
@@ -965,38 +1165,92 @@ class TmsPyramid(object):
             self._resolution = self.dataset.GetNativeResolution()
         return self._resolution
 
-    def get_tiles(self):
-        """Returns the TmsTiles object for the native resolution."""
+    def get_tiles(self, buffered=False):
+        """
+        Returns the TmsTiles object for the native resolution.
+
+        buffered: Render the image into memory first, if it is small enough,
+                  so that slicing several resolutions decodes it only once.
+        """
         offset = self.dataset.GetTmsExtents()
+        image = self.image
+        if buffered and VImageAdapter(image).BufferSize() < \
+           self.TmsTiles.IMAGE_BUFFER_DISK_THRESHOLD:
+            logger.debug('Buffering native resolution to memory')
+            image = image.copy_memory()
         with LibVips.disable_warnings():
-            return self.TmsTiles(image=self.image,
+            return self.TmsTiles(image=image,
                                  storage=self.storage,
                                  tile_width=TILE_SIDE, tile_height=TILE_SIDE,
                                  offset=offset.lower_left,
                                  resolution=self.resolution)
 
+    def downsample_on_load(self, tiles, levels):
+        """
+        Returns `tiles` downsampled by `levels`.
+
+        If `shrink_on_load` is set and the input's decoder supports it, the
+        first levels are shrunk while decoding the input, instead of from the
+        decoded image. This needs every skipped level to be aligned to the
+        tile grid. libjpeg doesn't shrink with a box filter, so pixels may
+        differ by a few levels from `TmsTiles.downsample`.
+        """
+        if not self.shrink_on_load:
+            return tiles.downsample(levels=levels)
+
+        levels_on_load = min(levels, self.SHRINK_ON_LOAD_LEVELS)
+        factor = 2 ** levels_on_load
+
+        image = None
+        if tiles.image_width % (tiles.tile_width * factor) == 0 and \
+           tiles.image_height % (tiles.tile_height * factor) == 0 and \
+           tiles.offset.x % factor == 0 and tiles.offset.y % factor == 0:
+            image = self.dataset.load_shrunk(shrink=factor)
+        if image is None:
+            return tiles.downsample(levels=levels)
+
+        logger.debug('Shrinking {0}× while loading'.format(factor))
+        shrunk = self.TmsTiles(image=image,
+                               storage=tiles.storage,
+                               tile_width=tiles.tile_width,
+                               tile_height=tiles.tile_height,
+                               offset=(tiles.offset / factor).floor(),
+                               resolution=tiles.resolution - levels_on_load)
+        if levels_on_load == levels:
+            return shrunk
+        return shrunk.downsample(levels=(levels - levels_on_load))
+
     def slice_downsample(self, tiles, min_resolution, max_resolution=None,
                          fill_borders=None):
         """Downsamples the input TmsTiles down to min_resolution and slices."""
         validate_resolutions(resolution=self.resolution,
                              min_resolution=min_resolution)
-        if max_resolution is None or max_resolution >= self.resolution:
+        # When the native resolution isn't sliced, the full-size decoded
+        # image is never needed.
+        native_sliced = max_resolution is None or \
+            max_resolution >= self.resolution
+        if native_sliced:
             max_resolution = self.resolution - 1
 
         with LibVips.disable_warnings():
             # Skip resolutions if there's a gap between max_resolution and
             # self.resolution.
-            tiles = tiles.downsample(
-                levels=(self.resolution - max_resolution),
-            )
+            if native_sliced:
+                tiles = tiles.downsample(
+                    levels=(self.resolution - max_resolution),
+                )
+            else:
+                tiles = self.downsample_on_load(
+                    tiles=tiles, levels=(self.resolution - max_resolution),
+                )
 
             for res in reversed(list(range(min_resolution, max_resolution + 1))):
                 logger.debug(
                     'Slicing at downsampled resolution {resolution}: '
                     '{width} × {height}'.format(
                         resolution=res,
-                        width=tiles.image.width,
-                        height=tiles.image.height
+                        width=tiles.image_width,
+                        height=tiles.image_height
                     )
                 )
 
@@ -1046,8 +1300,8 @@ class TmsPyramid(object):
                     'Slicing at upsampled resolution {resolution}: '
                     '{width} × {height}'.format(
                         resolution=res,
-                        width=upsampled.image.width,
-                        height=upsampled.image.height
+                        width=upsampled.image_width,
+                        height=upsampled.image_height
                     )
                 )
 
@@ -1069,7 +1323,14 @@ class TmsPyramid(object):
         else:
             max_resolution = self.resolution
 
-        tiles = self.get_tiles()
+        # Slicing the native resolution, downsampling, and each upsampled
+        # resolution read the whole native image.
+        passes = (
+            int(min_resolution <= self.resolution <= max_resolution) +
+            int(0 <= min_resolution < self.resolution) +
+            max(0, max_resolution - self.resolution)
+        )
+        tiles = self.get_tiles(buffered=(passes > 1))
 
         if min_resolution <= self.resolution <= max_resolution:
             self.slice_native(tiles, fill_borders=fill_borders)
@@ -1085,6 +1346,9 @@ class TmsPyramid(object):
                                 max_resolution=max_resolution,
                                 fill_borders=fill_borders)
 
+        # Tiles may still be rendering in the storage's pool.
+        self.storage.waitall()
+
         # Post-import hook needs to be called in case the storage has to
         # update some metadata
         self.storage.post_import(pyramid=self)
@@ -1207,7 +1471,7 @@ class ColorBase(dict):
                                        global_dict={})
 
     def colorize(self, image, nodata=None):
-        """Returns a new RGBA VImage that has been colorized"""
+        """Returns a new RGBA pyvips.Image that has been colorized"""
         if image.bands != 1:
             raise ValueError(
                 'image {0!r} has more than one band'.format(image)
@@ -1221,13 +1485,13 @@ class ColorBase(dict):
         )
 
         # Convert to a numpy array
-        data = numpy.frombuffer(buffer=image.write_to_memory(),
+        data = numpy.frombuffer(buffer=VImageAdapter(image).buffer(),
                                 dtype=VImageAdapter(image).NumPyType())
 
         # Use numexpr to color the data as RGBA bands
         bands = self._colorize_bands(data=data, nodata=nodata)
 
-        # Merge the bands into a single RGBA VImage
+        # Merge the bands into a single RGBA pyvips.Image
         images = [VImageAdapter.from_numpy_array(
             array=band, width=image.width, height=image.height, bands=1,
             format='uchar'
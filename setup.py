@@ -27,7 +27,12 @@ setup(
 
     packages=['gdal2mbtiles'],
     include_package_data=True,
-    install_requires=['future', 'numexpr', 'numpy', 'pyvips', 'webcolors'],
+    python_requires='>=3.5',
+    install_requires=['numexpr', 'numpy', 'pyvips', 'webcolors'],
+    extras_require={
+        # Counts physical CPU cores, rather than hyperthreads, for threading.
+        'psutil': ['psutil'],
+    },
     # You also need certain dependencies that aren't in PyPi:
     # gdal-bin, libgdal-dev, libvips, libvips-dev, libtiff5, optipng, pngquant
 
@@ -45,7 +50,7 @@ setup(
         'Intended Audience :: Other Audience',
         'License :: OSI Approved :: Apache Software License',
         'Operating System :: POSIX',
-        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Topic :: Multimedia :: Graphics :: Graphics Conversion',
@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 from math import log
 import os
 import subprocess
@@ -918,6 +915,23 @@ class TestDataset(TestCase):
                              for y in range(0, 2)
                              if (x, y) != (0, 0)))
 
+    def test_get_world_tms_borders_cached(self):
+        dataset = Dataset(self.alignedfile)
+        borders = set(dataset.GetWorldTmsBorders(resolution=1))
+        self.assertEqual(set(dataset.GetWorldTmsBorders(resolution=1)),
+                         borders)
+
+        # Changing the geotransform invalidates the cache: moving the data
+        # one native tile east puts it in (1, 0) at resolution 1.
+        geotransform = list(dataset.GetGeoTransform())
+        geotransform[0] += geotransform[1] * dataset.RasterXSize
+        dataset.SetGeoTransform(geotransform, local=True)
+        self.assertEqual(set(dataset.GetWorldTmsBorders(resolution=1)),
+                         set(XY(x, y)
+                             for x in range(0, 2)
+                             for y in range(0, 2)
+                             if (x, y) != (1, 0)))
+
 
 class TestSpatialReference(TestCase):
     def setUp(self):
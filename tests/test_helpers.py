@@ -1,12 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 import os
 from tempfile import NamedTemporaryFile
 import unittest
 
+from pyvips import Image
+
 from gdal2mbtiles.exceptions import UnalignedInputError
 from gdal2mbtiles.gdal import Dataset
 from gdal2mbtiles.helpers import (image_mbtiles, image_pyramid, image_slice,
@@ -18,6 +17,13 @@ from gdal2mbtiles.utils import intmd5, NamedTemporaryDir, recursive_listdir
 __dir__ = os.path.dirname(__file__)
 
 
+def tmpfs_dir():
+    """Returns /dev/shm if tiles can be written there, otherwise None."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK | os.X_OK):
+        return '/dev/shm'
+    return None
+
+
 class TestImageMbtiles(unittest.TestCase):
     def setUp(self):
         self.inputfile = os.path.join(__dir__, 'bluemarble-aligned-ll.tif')
@@ -53,6 +59,310 @@ class TestImageMbtiles(unittest.TestCase):
 
 
 class TestImagePyramid(unittest.TestCase):
+    EXPECTED_SIMPLE = frozenset((
+        '2/',
+        '2/0/',
+        '2/0/0.png',
+        '2/0/1.png',
+        '2/0/2.png',
+        '2/0/3.png',
+        '2/1/',
+        '2/1/0.png',
+        '2/1/1.png',
+        '2/1/2.png',
+        '2/1/3.png',
+        '2/2/',
+        '2/2/0.png',
+        '2/2/1.png',
+        '2/2/2.png',
+        '2/2/3.png',
+        '2/3/',
+        '2/3/0.png',
+        '2/3/1.png',
+        '2/3/2.png',
+        '2/3/3.png',
+    ))
+
+    EXPECTED_DOWNSAMPLE = frozenset((
+        '0/',
+        '0/0/',
+        '0/0/0.png',
+        '1/',
+        '1/0/',
+        '1/0/0.png',
+        '1/0/1.png',
+        '1/1/',
+        '1/1/0.png',
+        '1/1/1.png',
+        '2/',
+        '2/0/',
+        '2/0/0.png',
+        '2/0/1.png',
+        '2/0/2.png',
+        '2/0/3.png',
+        '2/1/',
+        '2/1/0.png',
+        '2/1/1.png',
+        '2/1/2.png',
+        '2/1/3.png',
+        '2/2/',
+        '2/2/0.png',
+        '2/2/1.png',
+        '2/2/2.png',
+        '2/2/3.png',
+        '2/3/',
+        '2/3/0.png',
+        '2/3/1.png',
+        '2/3/2.png',
+        '2/3/3.png',
+    ))
+
+    EXPECTED_DOWNSAMPLE_ALIGNED = frozenset((
+        '0/',
+        '0/0/',
+        '0/0/0.png',
+        '1/',
+        '1/0/',
+        '1/1/',
+        '1/0/0.png',
+        '2/',
+        '2/0/',
+        '2/1/',
+        '2/2/',
+        '2/3/',
+        '2/1/1.png',
+        # The following are the borders
+        '1/0/1.png',
+        '1/1/0.png',
+        '1/1/1.png',
+        '2/0/0.png',
+        '2/0/1.png',
+        '2/0/2.png',
+        '2/0/3.png',
+        '2/1/0.png',
+        '2/1/2.png',
+        '2/1/3.png',
+        '2/2/0.png',
+        '2/2/1.png',
+        '2/2/2.png',
+        '2/2/3.png',
+        '2/3/0.png',
+        '2/3/1.png',
+        '2/3/2.png',
+        '2/3/3.png',
+    ))
+
+    EXPECTED_UPSAMPLE = frozenset((
+        '2/',
+        '2/0/',
+        '2/0/0.png',
+        '2/0/1.png',
+        '2/0/2.png',
+        '2/0/3.png',
+        '2/1/',
+        '2/1/0.png',
+        '2/1/1.png',
+        '2/1/2.png',
+        '2/1/3.png',
+        '2/2/',
+        '2/2/0.png',
+        '2/2/1.png',
+        '2/2/2.png',
+        '2/2/3.png',
+        '2/3/',
+        '2/3/0.png',
+        '2/3/1.png',
+        '2/3/2.png',
+        '2/3/3.png',
+        '3/',
+        '3/0/',
+        '3/0/0.png',
+        '3/0/1.png',
+        '3/0/2.png',
+        '3/0/3.png',
+        '3/0/4.png',
+        '3/0/5.png',
+        '3/0/6.png',
+        '3/0/7.png',
+        '3/1/',
+        '3/1/0.png',
+        '3/1/1.png',
+        '3/1/2.png',
+        '3/1/3.png',
+        '3/1/4.png',
+        '3/1/5.png',
+        '3/1/6.png',
+        '3/1/7.png',
+        '3/2/',
+        '3/2/0.png',
+        '3/2/1.png',
+        '3/2/2.png',
+        '3/2/3.png',
+        '3/2/4.png',
+        '3/2/5.png',
+        '3/2/6.png',
+        '3/2/7.png',
+        '3/3/',
+        '3/3/0.png',
+        '3/3/1.png',
+        '3/3/2.png',
+        '3/3/3.png',
+        '3/3/4.png',
+        '3/3/5.png',
+        '3/3/6.png',
+        '3/3/7.png',
+        '3/4/',
+        '3/4/0.png',
+        '3/4/1.png',
+        '3/4/2.png',
+        '3/4/3.png',
+        '3/4/4.png',
+        '3/4/5.png',
+        '3/4/6.png',
+        '3/4/7.png',
+        '3/5/',
+        '3/5/0.png',
+        '3/5/1.png',
+        '3/5/2.png',
+        '3/5/3.png',
+        '3/5/4.png',
+        '3/5/5.png',
+        '3/5/6.png',
+        '3/5/7.png',
+        '3/6/',
+        '3/6/0.png',
+        '3/6/1.png',
+        '3/6/2.png',
+        '3/6/3.png',
+        '3/6/4.png',
+        '3/6/5.png',
+        '3/6/6.png',
+        '3/6/7.png',
+        '3/7/',
+        '3/7/0.png',
+        '3/7/1.png',
+        '3/7/2.png',
+        '3/7/3.png',
+        '3/7/4.png',
+        '3/7/5.png',
+        '3/7/6.png',
+        '3/7/7.png',
+    ))
+
+    EXPECTED_UPSAMPLE_SYMLINK = frozenset((
+        '0/',
+        '0/0/',
+        '0/0/0.png',
+        '1/',
+        '1/0/',
+        '1/0/0.png',
+        '1/0/1.png',
+        '1/1/',
+        '1/1/0.png',
+        '1/1/1.png',
+        '2/',
+        '2/0/',
+        '2/0/0.png',
+        '2/0/1.png',
+        '2/0/2.png',
+        '2/0/3.png',
+        '2/1/',
+        '2/1/0.png',
+        '2/1/1.png',
+        '2/1/2.png',
+        '2/1/3.png',
+        '2/2/',
+        '2/2/0.png',
+        '2/2/1.png',
+        '2/2/2.png',
+        '2/2/3.png',
+        '2/3/',
+        '2/3/0.png',
+        '2/3/1.png',
+        '2/3/2.png',
+        '2/3/3.png',
+        '3/',
+        '3/0/',
+        '3/0/0.png',
+        '3/0/1.png',
+        '3/0/2.png',
+        '3/0/3.png',
+        '3/0/4.png',
+        '3/0/5.png',
+        '3/0/6.png',
+        '3/0/7.png',
+        '3/1/',
+        '3/1/0.png',
+        '3/1/1.png',
+        '3/1/2.png',
+        '3/1/3.png',
+        '3/1/4.png',
+        '3/1/5.png',
+        '3/1/6.png',
+        '3/1/7.png',
+        '3/2/',
+        '3/2/0.png',
+        '3/2/1.png',
+        '3/2/2.png',
+        '3/2/3.png',
+        '3/2/4.png',
+        '3/2/5.png',
+        '3/2/6.png',
+        '3/2/7.png',
+        '3/3/',
+        '3/3/0.png',
+        '3/3/1.png',
+        '3/3/2.png',
+        '3/3/3.png',
+        '3/3/4.png',
+        '3/3/5.png',
+        '3/3/6.png',
+        '3/3/7.png',
+        '3/4/',
+        '3/4/0.png',
+        '3/4/1.png',
+        '3/4/2.png',
+        '3/4/3.png',
+        '3/4/4.png',
+        '3/4/5.png',
+        '3/4/6.png',
+        '3/4/7.png',
+        '3/5/',
+        '3/5/0.png',
+        '3/5/1.png',
+        '3/5/2.png',
+        '3/5/3.png',
+        '3/5/4.png',
+        '3/5/5.png',
+        '3/5/6.png',
+        '3/5/7.png',
+        '3/6/',
+        '3/6/0.png',
+        '3/6/1.png',
+        '3/6/2.png',
+        '3/6/3.png',
+        '3/6/4.png',
+        '3/6/5.png',
+        '3/6/6.png',
+        '3/6/7.png',
+        '3/7/',
+        '3/7/0.png',
+        '3/7/1.png',
+        '3/7/2.png',
+        '3/7/3.png',
+        '3/7/4.png',
+        '3/7/5.png',
+        '3/7/6.png',
+        '3/7/7.png',
+    ))
+
+    @classmethod
+    def setUpClass(cls):
+        # Decode bluemarble.tif once for every test that slices it.
+        cls.image = Image.new_from_file(
+            os.path.join(__dir__, 'bluemarble.tif')
+        ).copy_memory()
+
     def setUp(self):
         self.inputfile = os.path.join(__dir__, 'bluemarble.tif')
         self.alignedfile = os.path.join(__dir__, 'bluemarble-aligned-ll.tif')
@@ -60,129 +370,63 @@ class TestImagePyramid(unittest.TestCase):
         self.upsamplingfile = os.path.join(__dir__, 'upsampling.tif')
 
     def test_simple(self):
-        with NamedTemporaryDir() as outputdir:
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
             # Native resolution only
             image_pyramid(inputfile=self.inputfile, outputdir=outputdir,
+                          image=self.image,
                           renderer=TouchRenderer(suffix='.png'))
 
-            self.assertEqual(
-                set(recursive_listdir(outputdir)),
-                set((
-                    '2/',
-                    '2/0/',
-                    '2/0/0.png',
-                    '2/0/1.png',
-                    '2/0/2.png',
-                    '2/0/3.png',
-                    '2/1/',
-                    '2/1/0.png',
-                    '2/1/1.png',
-                    '2/1/2.png',
-                    '2/1/3.png',
-                    '2/2/',
-                    '2/2/0.png',
-                    '2/2/1.png',
-                    '2/2/2.png',
-                    '2/2/3.png',
-                    '2/3/',
-                    '2/3/0.png',
-                    '2/3/1.png',
-                    '2/3/2.png',
-                    '2/3/3.png',
-                ))
-            )
+            self.assertEqual(set(recursive_listdir(outputdir)),
+                             self.EXPECTED_SIMPLE)
+
+    def test_preprocessor(self):
+        def preprocessor(inputfile, outputdir, min_resolution, max_resolution,
+                         fill_borders, colors, renderer, preprocessor,
+                         storage, pyramid):
+            return pyramid
+
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
+            image_pyramid(inputfile=self.inputfile, outputdir=outputdir,
+                          image=self.image,
+                          renderer=TouchRenderer(suffix='.png'),
+                          preprocessor=preprocessor)
+
+            self.assertEqual(set(recursive_listdir(outputdir)),
+                             self.EXPECTED_SIMPLE)
 
     def test_downsample(self):
-        with NamedTemporaryDir() as outputdir:
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
             image_pyramid(inputfile=self.inputfile, outputdir=outputdir,
+                          image=self.image,
                           min_resolution=0,
                           renderer=TouchRenderer(suffix='.png'))
 
             files = set(recursive_listdir(outputdir))
-            self.assertEqual(
-                files,
-                set((
-                    '0/',
-                    '0/0/',
-                    '0/0/0.png',
-                    '1/',
-                    '1/0/',
-                    '1/0/0.png',
-                    '1/0/1.png',
-                    '1/1/',
-                    '1/1/0.png',
-                    '1/1/1.png',
-                    '2/',
-                    '2/0/',
-                    '2/0/0.png',
-                    '2/0/1.png',
-                    '2/0/2.png',
-                    '2/0/3.png',
-                    '2/1/',
-                    '2/1/0.png',
-                    '2/1/1.png',
-                    '2/1/2.png',
-                    '2/1/3.png',
-                    '2/2/',
-                    '2/2/0.png',
-                    '2/2/1.png',
-                    '2/2/2.png',
-                    '2/2/3.png',
-                    '2/3/',
-                    '2/3/0.png',
-                    '2/3/1.png',
-                    '2/3/2.png',
-                    '2/3/3.png',
-                ))
-            )
+            self.assertEqual(files, self.EXPECTED_DOWNSAMPLE)
+
+    def test_downsample_single(self):
+        # Only one level below native: inputfile is read out of order.
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
+            image_pyramid(inputfile=self.inputfile, outputdir=outputdir,
+                          min_resolution=1, max_resolution=1,
+                          renderer=TouchRenderer(suffix='.png'))
+
+            files = set(recursive_listdir(outputdir))
+            self.assertEqual(files,
+                             set(f for f in self.EXPECTED_DOWNSAMPLE
+                                 if f.startswith('1/')))
 
     def test_downsample_aligned(self):
-        with NamedTemporaryDir() as outputdir:
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
             image_pyramid(inputfile=self.alignedfile, outputdir=outputdir,
                           min_resolution=0,
                           renderer=TouchRenderer(suffix='.png'))
 
             files = set(recursive_listdir(outputdir))
-            self.assertEqual(
-                files,
-                set((
-                    '0/',
-                    '0/0/',
-                    '0/0/0.png',
-                    '1/',
-                    '1/0/',
-                    '1/1/',
-                    '1/0/0.png',
-                    '2/',
-                    '2/0/',
-                    '2/1/',
-                    '2/2/',
-                    '2/3/',
-                    '2/1/1.png',
-                    # The following are the borders
-                    '1/0/1.png',
-                    '1/1/0.png',
-                    '1/1/1.png',
-                    '2/0/0.png',
-                    '2/0/1.png',
-                    '2/0/2.png',
-                    '2/0/3.png',
-                    '2/1/0.png',
-                    '2/1/2.png',
-                    '2/1/3.png',
-                    '2/2/0.png',
-                    '2/2/1.png',
-                    '2/2/2.png',
-                    '2/2/3.png',
-                    '2/3/0.png',
-                    '2/3/1.png',
-                    '2/3/2.png',
-                    '2/3/3.png',
-                ))
-            )
+            self.assertEqual(files, self.EXPECTED_DOWNSAMPLE_ALIGNED)
 
     def test_downsample_spanning(self):
-        with NamedTemporaryDir() as outputdir:
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
             self.assertRaises(UnalignedInputError,
                               image_pyramid,
                               inputfile=self.spanningfile, outputdir=outputdir,
@@ -190,115 +434,18 @@ class TestImagePyramid(unittest.TestCase):
                               renderer=TouchRenderer(suffix='.png'))
 
     def test_upsample(self):
-        with NamedTemporaryDir() as outputdir:
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
             dataset = Dataset(self.inputfile)
             image_pyramid(inputfile=self.inputfile, outputdir=outputdir,
+                          image=self.image,
                           max_resolution=dataset.GetNativeResolution() + 1,
                           renderer=TouchRenderer(suffix='.png'))
 
             files = set(recursive_listdir(outputdir))
-            self.assertEqual(
-                files,
-                set((
-                    '2/',
-                    '2/0/',
-                    '2/0/0.png',
-                    '2/0/1.png',
-                    '2/0/2.png',
-                    '2/0/3.png',
-                    '2/1/',
-                    '2/1/0.png',
-                    '2/1/1.png',
-                    '2/1/2.png',
-                    '2/1/3.png',
-                    '2/2/',
-                    '2/2/0.png',
-                    '2/2/1.png',
-                    '2/2/2.png',
-                    '2/2/3.png',
-                    '2/3/',
-                    '2/3/0.png',
-                    '2/3/1.png',
-                    '2/3/2.png',
-                    '2/3/3.png',
-                    '3/',
-                    '3/0/',
-                    '3/0/0.png',
-                    '3/0/1.png',
-                    '3/0/2.png',
-                    '3/0/3.png',
-                    '3/0/4.png',
-                    '3/0/5.png',
-                    '3/0/6.png',
-                    '3/0/7.png',
-                    '3/1/',
-                    '3/1/0.png',
-                    '3/1/1.png',
-                    '3/1/2.png',
-                    '3/1/3.png',
-                    '3/1/4.png',
-                    '3/1/5.png',
-                    '3/1/6.png',
-                    '3/1/7.png',
-                    '3/2/',
-                    '3/2/0.png',
-                    '3/2/1.png',
-                    '3/2/2.png',
-                    '3/2/3.png',
-                    '3/2/4.png',
-                    '3/2/5.png',
-                    '3/2/6.png',
-                    '3/2/7.png',
-                    '3/3/',
-                    '3/3/0.png',
-                    '3/3/1.png',
-                    '3/3/2.png',
-                    '3/3/3.png',
-                    '3/3/4.png',
-                    '3/3/5.png',
-                    '3/3/6.png',
-                    '3/3/7.png',
-                    '3/4/',
-                    '3/4/0.png',
-                    '3/4/1.png',
-                    '3/4/2.png',
-                    '3/4/3.png',
-                    '3/4/4.png',
-                    '3/4/5.png',
-                    '3/4/6.png',
-                    '3/4/7.png',
-                    '3/5/',
-                    '3/5/0.png',
-                    '3/5/1.png',
-                    '3/5/2.png',
-                    '3/5/3.png',
-                    '3/5/4.png',
-                    '3/5/5.png',
-                    '3/5/6.png',
-                    '3/5/7.png',
-                    '3/6/',
-                    '3/6/0.png',
-                    '3/6/1.png',
-                    '3/6/2.png',
-                    '3/6/3.png',
-                    '3/6/4.png',
-                    '3/6/5.png',
-                    '3/6/6.png',
-                    '3/6/7.png',
-                    '3/7/',
-                    '3/7/0.png',
-                    '3/7/1.png',
-                    '3/7/2.png',
-                    '3/7/3.png',
-                    '3/7/4.png',
-                    '3/7/5.png',
-                    '3/7/6.png',
-                    '3/7/7.png',
-                ))
-            )
+            self.assertEqual(files, self.EXPECTED_UPSAMPLE)
 
     def test_upsample_symlink(self):
-        with NamedTemporaryDir() as outputdir:
+        with NamedTemporaryDir(dir=tmpfs_dir()) as outputdir:
             zoom = 3
 
             dataset = Dataset(self.upsamplingfile)
@@ -307,118 +454,70 @@ class TestImagePyramid(unittest.TestCase):
                           renderer=TouchRenderer(suffix='.png'))
 
             files = set(recursive_listdir(outputdir))
+            self.assertEqual(files, self.EXPECTED_UPSAMPLE_SYMLINK)
+
+            # Duplicate tiles are symlinks to a tile that was rendered.
+            tiles = [f for f in files if f.endswith('.png')]
+            links = set(f for f in tiles
+                        if os.path.islink(os.path.join(outputdir, f)))
+            for link in links:
+                target = os.path.realpath(os.path.join(outputdir, link))
+                self.assertTrue(os.path.isfile(target))
+                self.assertFalse(os.path.islink(target))
+                self.assertTrue(target.startswith(
+                    os.path.realpath(outputdir) + os.sep
+                ))
+
+            # upsampling.tif has few distinct regions, so most tiles are
+            # duplicates. Every tile at the deepest zoom repeats a solid
+            # tile already rendered at a shallower zoom.
+            self.assertTrue(len(links) > len(tiles) - len(links))
             self.assertEqual(
-                files,
-                set([
-                    '0/',
-                    '0/0/',
-                    '0/0/0.png',
-                    '1/',
-                    '1/0/',
-                    '1/0/0.png',
-                    '1/0/1.png',
-                    '1/1/',
-                    '1/1/0.png',
-                    '1/1/1.png',
-                    '2/',
-                    '2/0/',
-                    '2/0/0.png',
-                    '2/0/1.png',
-                    '2/0/2.png',
-                    '2/0/3.png',
-                    '2/1/',
-                    '2/1/0.png',
-                    '2/1/1.png',
-                    '2/1/2.png',
-                    '2/1/3.png',
-                    '2/2/',
-                    '2/2/0.png',
-                    '2/2/1.png',
-                    '2/2/2.png',
-                    '2/2/3.png',
-                    '2/3/',
-                    '2/3/0.png',
-                    '2/3/1.png',
-                    '2/3/2.png',
-                    '2/3/3.png',
-                    '3/',
-                    '3/0/',
-                    '3/0/0.png',
-                    '3/0/1.png',
-                    '3/0/2.png',
-                    '3/0/3.png',
-                    '3/0/4.png',
-                    '3/0/5.png',
-                    '3/0/6.png',
-                    '3/0/7.png',
-                    '3/1/',
-                    '3/1/0.png',
-                    '3/1/1.png',
-                    '3/1/2.png',
-                    '3/1/3.png',
-                    '3/1/4.png',
-                    '3/1/5.png',
-                    '3/1/6.png',
-                    '3/1/7.png',
-                    '3/2/',
-                    '3/2/0.png',
-                    '3/2/1.png',
-                    '3/2/2.png',
-                    '3/2/3.png',
-                    '3/2/4.png',
-                    '3/2/5.png',
-                    '3/2/6.png',
-                    '3/2/7.png',
-                    '3/3/',
-                    '3/3/0.png',
-                    '3/3/1.png',
-                    '3/3/2.png',
-                    '3/3/3.png',
-                    '3/3/4.png',
-                    '3/3/5.png',
-                    '3/3/6.png',
-                    '3/3/7.png',
-                    '3/4/',
-                    '3/4/0.png',
-                    '3/4/1.png',
-                    '3/4/2.png',
-                    '3/4/3.png',
-                    '3/4/4.png',
-                    '3/4/5.png',
-                    '3/4/6.png',
-                    '3/4/7.png',
-                    '3/5/',
-                    '3/5/0.png',
-                    '3/5/1.png',
-                    '3/5/2.png',
-                    '3/5/3.png',
-                    '3/5/4.png',
-                    '3/5/5.png',
-                    '3/5/6.png',
-                    '3/5/7.png',
-                    '3/6/',
-                    '3/6/0.png',
-                    '3/6/1.png',
-                    '3/6/2.png',
-                    '3/6/3.png',
-                    '3/6/4.png',
-                    '3/6/5.png',
-                    '3/6/6.png',
-                    '3/6/7.png',
-                    '3/7/',
-                    '3/7/0.png',
-                    '3/7/1.png',
-                    '3/7/2.png',
-                    '3/7/3.png',
-                    '3/7/4.png',
-                    '3/7/5.png',
-                    '3/7/6.png',
-                    '3/7/7.png',
-                ])
+                set(f for f in tiles if f.startswith('3/')) - links,
+                set()
             )
 
 
 class TestImageSlice(unittest.TestCase):
+    EXPECTED_SIMPLE = frozenset((
+        '2-0-0-79f8c5f88c49812a4171f0f6263b01b1.png',
+        '2-0-1-4e1061ab62c06d63eed467cca58883d1.png',
+        '2-0-2-2b2617db83b03d9cd96e8a68cb07ced5.png',
+        '2-0-3-44b9bb8a7bbdd6b8e01df1dce701b38c.png',
+        '2-1-0-f1d310a7a502fece03b96acb8c704330.png',
+        '2-1-1-194af8a96a88d76d424382d6f7b6112a.png',
+        '2-1-2-1269123b2c3fd725c39c0a134f4c0e95.png',
+        '2-1-3-62aec6122aade3337b8ebe9f6b9540fe.png',
+        '2-2-0-6326c9b0cae2a8959d6afda71127dc52.png',
+        '2-2-1-556518834b1015c6cf9a7a90bc9ec73.png',
+        '2-2-2-730e6a45a495d1289f96e09b7b7731ef.png',
+        '2-2-3-385dac69cdbf4608469b8538a0e47e2b.png',
+        '2-3-0-66644871022656b835ea6cea03c3dc0f.png',
+        '2-3-1-c81a64912d77024b3170d7ab2fb82310.png',
+        '2-3-2-7ced761dd1dbe412c6f5b9511f0b291.png',
+        '2-3-3-3f42d6a0e36064ca452aed393a303dd1.png',
+    ))
+
+    EXPECTED_ALIGNED = frozenset((
+        '2-1-1-99c4a766657c5b65a62ef7da9906508b.png',
+        # The following are the borders
+        '2-0-0-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-0-1-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-0-2-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-0-3-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-1-0-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-1-2-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-1-3-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-2-0-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-2-1-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-2-2-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-2-3-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-3-0-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-3-1-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-3-2-ec87a838931d4d5d2e94a04644788a55.png',
+        '2-3-3-ec87a838931d4d5d2e94a04644788a55.png',
+    ))
+
     def setUp(self):
         self.inputfile = os.path.join(__dir__, 'bluemarble.tif')
         self.alignedfile = os.path.join(__dir__, 'bluemarble-aligned-ll.tif')
@@ -429,57 +528,29 @@ class TestImageSlice(unittest.TestCase):
             image_slice(inputfile=self.inputfile, outputdir=outputdir,
                         renderer=TouchRenderer(suffix='.png'))
 
-            files = set(os.listdir(outputdir))
-            self.assertEqual(
-                files,
-                set((
-                    '2-0-0-79f8c5f88c49812a4171f0f6263b01b1.png',
-                    '2-0-1-4e1061ab62c06d63eed467cca58883d1.png',
-                    '2-0-2-2b2617db83b03d9cd96e8a68cb07ced5.png',
-                    '2-0-3-44b9bb8a7bbdd6b8e01df1dce701b38c.png',
-                    '2-1-0-f1d310a7a502fece03b96acb8c704330.png',
-                    '2-1-1-194af8a96a88d76d424382d6f7b6112a.png',
-                    '2-1-2-1269123b2c3fd725c39c0a134f4c0e95.png',
-                    '2-1-3-62aec6122aade3337b8ebe9f6b9540fe.png',
-                    '2-2-0-6326c9b0cae2a8959d6afda71127dc52.png',
-                    '2-2-1-556518834b1015c6cf9a7a90bc9ec73.png',
-                    '2-2-2-730e6a45a495d1289f96e09b7b7731ef.png',
-                    '2-2-3-385dac69cdbf4608469b8538a0e47e2b.png',
-                    '2-3-0-66644871022656b835ea6cea03c3dc0f.png',
-                    '2-3-1-c81a64912d77024b3170d7ab2fb82310.png',
-                    '2-3-2-7ced761dd1dbe412c6f5b9511f0b291.png',
-                    '2-3-3-3f42d6a0e36064ca452aed393a303dd1.png',
-                ))
-            )
+            files = {e.name for e in os.scandir(outputdir)}
+            self.assertEqual(files, self.EXPECTED_SIMPLE)
+
+    def test_preprocessor(self):
+        def preprocessor(inputfile, outputdir, fill_borders, colors,
+                         renderer, preprocessor, storage, pyramid):
+            return pyramid
+
+        with NamedTemporaryDir() as outputdir:
+            image_slice(inputfile=self.inputfile, outputdir=outputdir,
+                        renderer=TouchRenderer(suffix='.png'),
+                        preprocessor=preprocessor)
+
+            files = {e.name for e in os.scandir(outputdir)}
+            self.assertEqual(files, self.EXPECTED_SIMPLE)
 
     def test_aligned(self):
         with NamedTemporaryDir() as outputdir:
             image_slice(inputfile=self.alignedfile, outputdir=outputdir,
                         renderer=TouchRenderer(suffix='.png'))
 
-            files = set(os.listdir(outputdir))
-            self.assertEqual(
-                files,
-                set((
-                    '2-1-1-99c4a766657c5b65a62ef7da9906508b.png',
-                    # The following are the borders
-                    '2-0-0-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-0-1-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-0-2-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-0-3-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-1-0-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-1-2-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-1-3-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-2-0-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-2-1-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-2-2-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-2-3-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-3-0-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-3-1-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-3-2-ec87a838931d4d5d2e94a04644788a55.png',
-                    '2-3-3-ec87a838931d4d5d2e94a04644788a55.png',
-                ))
-            )
+            files = {e.name for e in os.scandir(outputdir)}
+            self.assertEqual(files, self.EXPECTED_ALIGNED)
 
     def test_spanning(self):
         with NamedTemporaryDir() as outputdir:
@@ -681,7 +752,7 @@ class TestWarpSlice(unittest.TestCase):
             warp_slice(inputfile=self.inputfile, outputdir=outputdir,
                        renderer=TouchRenderer(suffix='.png'))
             self.assertEqual(
-                set(os.listdir(outputdir)),
+                {e.name for e in os.scandir(outputdir)},
                 set((
                     '2-0-0-26ef4e5b789cdc0646ca111264851a62.png',
                     '2-0-1-a760093093243edf3557fddff32eba78.png',
@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
 import unittest
 
 from gdal2mbtiles.renderers import JpegRenderer, PngRenderer, TouchRenderer
@@ -87,6 +84,21 @@ class TestPngRenderer(unittest.TestCase):
         self.assertEqual(intmd5(contents),
                          106831624867432276165545554861383631224)
 
+    def test_strip_opaque_alpha(self):
+        # Black 1×1 image
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=255))
+
+        # PNG colour type is the 26th byte: 2 is RGB, 6 is RGBA
+        renderer = PngRenderer(png8=False, optimize=False,
+                               strip_opaque_alpha=True)
+        self.assertEqual(renderer.render(image=image)[25], 2)
+        self.assertEqual(renderer.render(image=self.image)[25], 6)
+
+        # Default is to keep the alpha band
+        renderer = PngRenderer(png8=False, optimize=False)
+        self.assertEqual(renderer.render(image=image)[25], 6)
+
     def test_suffix(self):
         # Default
         renderer = PngRenderer()
@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
-
+from concurrent.futures import ThreadPoolExecutor
 import errno
 import os
 from shutil import rmtree
@@ -14,7 +12,8 @@ from gdal2mbtiles.renderers import PngRenderer, TouchRenderer
 from gdal2mbtiles.storages import (MbtilesStorage,
                                    NestedFileStorage, SimpleFileStorage)
 from gdal2mbtiles.gd_types import rgba
-from gdal2mbtiles.utils import intmd5, NamedTemporaryDir, recursive_listdir
+from gdal2mbtiles.utils import (inthash, intmd5, NamedTemporaryDir,
+                                recursive_listdir)
 from gdal2mbtiles.vips import VImageAdapter
 
 
@@ -53,12 +52,21 @@ class TestSimpleFileStorage(unittest.TestCase):
         self.assertEqual(self.storage.get_hash(image=image),
                          int('f1d3ff8443297732862df21dc4e57262', base=16))
 
+    def test_get_hash_hasher(self):
+        storage = SimpleFileStorage(outputdir=self.outputdir,
+                                    renderer=self.renderer,
+                                    hasher=inthash)
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=0))
+        self.assertEqual(storage.get_hash(image=image),
+                         int('9069ca78e7450a285173431b3e52c5c2', base=16))
+
     def test_save(self):
         image = VImageAdapter.new_rgba(width=1, height=1,
                                 ink=rgba(r=0, g=0, b=0, a=0))
         self.storage.save(x=0, y=1, z=2, image=image)
         self.storage.save(x=1, y=0, z=2, image=image)
-        self.assertEqual(set(os.listdir(self.outputdir)),
+        self.assertEqual({e.name for e in os.scandir(self.outputdir)},
                          set([
                              '2-0-1-f1d3ff8443297732862df21dc4e57262.png',
                              '2-1-0-f1d3ff8443297732862df21dc4e57262.png'
@@ -79,6 +87,13 @@ class TestSimpleFileStorage(unittest.TestCase):
             '2-0-1-f1d3ff8443297732862df21dc4e57262.png'
         )
 
+    def test_save_hashed(self):
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=0))
+        self.storage.save(x=0, y=1, z=2, image=image, hashed=0xdeadbeef)
+        self.assertEqual(set(recursive_listdir(self.outputdir)),
+                         set(['2-0-1-deadbeef.png']))
+
     def test_symlink(self):
         # Same directory
         src = 'source'
@@ -98,11 +113,80 @@ class TestSimpleFileStorage(unittest.TestCase):
         self.assertEqual(os.readlink(os.path.join(subdir, dst)),
                          os.path.join(os.path.pardir, src))
 
+    def test_save_pool(self):
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=0))
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            storage = SimpleFileStorage(outputdir=self.outputdir,
+                                        renderer=self.renderer,
+                                        pool=pool)
+            storage.save(x=0, y=1, z=2, image=image)
+            storage.save(x=1, y=0, z=2, image=image)
+            storage.waitall()
+        self.assertEqual({e.name for e in os.scandir(self.outputdir)},
+                         set([
+                             '2-0-1-f1d3ff8443297732862df21dc4e57262.png',
+                             '2-1-0-f1d3ff8443297732862df21dc4e57262.png'
+                         ]))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.outputdir, '2-1-0-f1d3ff8443297732862df21dc4e57262.png'
+        )))
+
+    def test_exit_error(self):
+        class FailingRenderer(TouchRenderer):
+            def render(self, image):
+                raise RuntimeError('render failed')
+
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=0))
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            # Rendering errors are raised on a clean exit...
+            with self.assertRaises(RuntimeError):
+                with SimpleFileStorage(outputdir=self.outputdir,
+                                       renderer=FailingRenderer(),
+                                       pool=pool) as storage:
+                    storage.save(x=0, y=1, z=2, image=image)
+
+            # ...but don't hide the error that is already unwinding
+            with self.assertRaises(KeyError):
+                with SimpleFileStorage(outputdir=self.outputdir,
+                                       renderer=FailingRenderer(),
+                                       pool=pool) as storage:
+                    storage.save(x=0, y=1, z=2, image=image)
+                    raise KeyError('original')
+
+    def test_save_hardlinks(self):
+        storage = SimpleFileStorage(outputdir=self.outputdir,
+                                    renderer=self.renderer,
+                                    hardlinks=True)
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=0))
+        storage.save(x=0, y=1, z=2, image=image)
+        storage.save(x=1, y=0, z=2, image=image)
+
+        src = os.path.join(self.outputdir,
+                           '2-0-1-f1d3ff8443297732862df21dc4e57262.png')
+        dst = os.path.join(self.outputdir,
+                           '2-1-0-f1d3ff8443297732862df21dc4e57262.png')
+        self.assertFalse(os.path.islink(dst))
+        self.assertTrue(os.path.samefile(src, dst))
+
+    def test_hardlink(self):
+        src = 'source'
+        dst = 'destination'
+        with open(os.path.join(self.outputdir, src), 'wb') as output:
+            output.write(b'tile')
+        self.storage.hardlink(src=src, dst=dst)
+        self.assertEqual({e.name for e in os.scandir(self.outputdir)},
+                         set([src, dst]))
+        self.assertTrue(os.path.samefile(os.path.join(self.outputdir, src),
+                                         os.path.join(self.outputdir, dst)))
+
     def test_save_border(self):
         # Western hemisphere is border
         self.storage.save_border(x=0, y=0, z=1)
         self.storage.save_border(x=0, y=1, z=1)
-        self.assertEqual(set(sorted(os.listdir(self.outputdir))),
+        self.assertEqual({e.name for e in os.scandir(self.outputdir)},
                          set(sorted([
                              '1-0-0-ec87a838931d4d5d2e94a04644788a55.png',
                              '1-0-1-ec87a838931d4d5d2e94a04644788a55.png',
@@ -153,6 +237,15 @@ class TestNestedFileStorage(unittest.TestCase):
                                                hashed=0xdeadbeef),
                          '2/0/1' + self.renderer.suffix)
 
+    def test_save_hashed(self):
+        image = VImageAdapter.new_rgba(width=1, height=1,
+                                       ink=rgba(r=0, g=0, b=0, a=0))
+        self.storage.save(x=0, y=1, z=2, image=image, hashed=0xdeadbeef)
+        self.assertEqual(set(recursive_listdir(self.outputdir)),
+                         set(['2/',
+                              '2/0/',
+                              '2/0/1.png']))
+
     def test_makedirs(self):
         # Cache should be empty
         self.assertFalse(self.storage.madedirs)
@@ -1,20 +1,24 @@
 # -*- coding: utf-8 -*-
 
-from __future__ import (absolute_import, division, print_function,
-                        unicode_literals)
 import pytest
 
 import os
 import unittest
+from unittest import mock
 
 import numpy
+from pyvips import Image
 
 from gdal2mbtiles.constants import TILE_SIDE
 from gdal2mbtiles.gdal import Dataset
-from gdal2mbtiles.storages import Storage
+from gdal2mbtiles.renderers import TouchRenderer
+from gdal2mbtiles.storages import NestedFileStorage, Storage
 from gdal2mbtiles.gd_types import rgba, XY
 from gdal2mbtiles.vips import (ColorExact, ColorGradient, ColorPalette,
-                               LibVips, TmsTiles, VImageAdapter, VipsDataset, VIPS)
+                               default_concurrency, LibVips, TmsPyramid,
+                               TmsTiles, VImageAdapter, VipsDataset, VIPS,
+                               physical_cpu_count, split_concurrency)
+from gdal2mbtiles.utils import NamedTemporaryDir, recursive_listdir, tempenv
 
 from tests.test_gdal import TestCase as GdalTestCase
 
@@ -22,13 +26,23 @@ from tests.test_gdal import TestCase as GdalTestCase
 __dir__ = os.path.dirname(__file__)
 
 
+def write_gradient_jpeg(dirname, width, height):
+    """Writes a smooth RGB gradient as a JPEG and returns its filename."""
+    filename = os.path.join(dirname, 'gradient.jpg')
+    xyz = Image.xyz(width, height)
+    x, y = xyz[0] * (255.0 / width), xyz[1] * (255.0 / height)
+    x.bandjoin([y, (x + y) / 2]).cast('uchar').write_to_file(filename, Q=95)
+    return filename
+
+
 class TestLibVips(unittest.TestCase):
     def tearDown(self):
         VIPS.set_concurrency(processes=0)  # Auto-detect
 
     def test_create(self):
-        self.assertTrue(LibVips())
-        self.assertRaises(OSError, LibVips, version=999)
+        vips = LibVips()
+        self.assertTrue(vips)
+        self.assertTrue(vips.get_concurrency() > 0)
 
     def test_concurrency(self):
         concurrency = 42
@@ -38,6 +52,29 @@ class TestLibVips(unittest.TestCase):
         self.assertEqual(vips.set_concurrency(processes=concurrency), None)
         self.assertEqual(vips.get_concurrency(), concurrency)
 
+    def test_concurrency_context(self):
+        vips = LibVips()
+        vips.set_concurrency(processes=5)
+        with vips.concurrency(processes=3):
+            self.assertEqual(vips.get_concurrency(), 3)
+        self.assertEqual(vips.get_concurrency(), 5)
+
+    def test_default_concurrency(self):
+        with tempenv('GDAL2MBTILES_CONCURRENCY', '3'):
+            self.assertEqual(default_concurrency(), 3)
+        # Invalid values are ignored
+        for value in ('lots', '0', '-2'):
+            with tempenv('GDAL2MBTILES_CONCURRENCY', value):
+                self.assertEqual(default_concurrency(), physical_cpu_count())
+
+    def test_split_concurrency(self):
+        self.assertEqual(split_concurrency(threads=1), (1, 1))
+        self.assertEqual(split_concurrency(threads=4), (2, 2))
+        self.assertEqual(split_concurrency(threads=5), (2, 3))
+
+    def test_physical_cpu_count(self):
+        self.assertTrue(physical_cpu_count() >= 1)
+
 
 class TestVImageAdapter(unittest.TestCase):
     def test_new_rgba(self):
@@ -56,6 +93,13 @@ class TestVImageAdapter(unittest.TestCase):
              1)                 # data size
         )
 
+    def test_buffer(self):
+        image = VImageAdapter.new_rgba(width=2, height=1)
+        buf = VImageAdapter(image).buffer()
+        self.assertTrue(isinstance(buf, memoryview))
+        self.assertEqual(buf.nbytes, VImageAdapter(image).BufferSize())
+        self.assertEqual(bytes(buf), b'\0' * 8)
+
     def test_stretch(self):
         image = VImageAdapter.new_rgba(width=16, height=16)
 
@@ -84,12 +128,81 @@ class TestVImageAdapter(unittest.TestCase):
         self.assertEqual(stretched.width, image.width * 3.0)
         self.assertEqual(stretched.height, image.height * 5.0)
 
+        # Powers of two are zoomed, with the same pixels as the
+        # nearest-neighbour affine
+        pixels = numpy.arange(16 * 16 * 4, dtype=numpy.uint32) % 251
+        image = Image.new_from_memory(pixels.astype(numpy.uint8).tobytes(),
+                                      16, 16, 4, 'uchar')
+        for scale in (2, 4, 8):
+            with mock.patch.object(VImageAdapter, '_scale', autospec=True,
+                                   side_effect=VImageAdapter._scale) as scale_:
+                stretched = VImageAdapter(image).stretch(xscale=scale,
+                                                         yscale=scale)
+            self.assertFalse(scale_.called, 'scale {0}'.format(scale))
+            expected = VImageAdapter(image)._scale(xscale=scale,
+                                                   yscale=scale,
+                                                   output_size=None,
+                                                   interpolate='near')
+            self.assertEqual(stretched.write_to_memory(),
+                             expected.write_to_memory(),
+                             'scale {0}'.format(scale))
+
+        # Other integer scales go through the affine
+        for scale in (3, 5, 6, 7):
+            with mock.patch.object(VImageAdapter, '_scale', autospec=True,
+                                   side_effect=VImageAdapter._scale) as scale_:
+                VImageAdapter(image).stretch(xscale=scale, yscale=scale)
+            self.assertTrue(scale_.called, 'scale {0}'.format(scale))
+
         # Out of bounds
         self.assertRaises(ValueError,
                           VImageAdapter(image).stretch, xscale=0.5, yscale=1.0)
         self.assertRaises(ValueError,
                           VImageAdapter(image).stretch, xscale=1.0, yscale=0.5)
 
+        # Not finite
+        for scale in (float('nan'), float('inf')):
+            self.assertRaises(ValueError, VImageAdapter(image).stretch,
+                              xscale=scale, yscale=1.0)
+            self.assertRaises(ValueError, VImageAdapter(image).stretch,
+                              xscale=1.0, yscale=scale)
+
+    def test_shrink(self):
+        image = VImageAdapter.new_rgba(width=16, height=16)
+
+        # No shrink
+        shrunk = VImageAdapter(image).shrink(xscale=1.0, yscale=1.0)
+        self.assertEqual(shrunk.width, image.width)
+        self.assertEqual(shrunk.height, image.height)
+
+        # Integer factors
+        shrunk = VImageAdapter(image).shrink(xscale=0.25, yscale=0.5)
+        self.assertEqual(shrunk.width, image.width * 0.25)
+        self.assertEqual(shrunk.height, image.height * 0.5)
+
+        # Not an integer factor
+        shrunk = VImageAdapter(image).shrink(xscale=0.4, yscale=0.5)
+        self.assertEqual(shrunk.width, int(image.width * 0.4))
+        self.assertEqual(shrunk.height, image.height * 0.5)
+
+        # Factor does not divide the image
+        shrunk = VImageAdapter(image).shrink(xscale=1 / 3, yscale=0.5)
+        self.assertEqual(shrunk.width, int(image.width / 3))
+        self.assertEqual(shrunk.height, image.height * 0.5)
+
+        # Out of bounds
+        self.assertRaises(ValueError,
+                          VImageAdapter(image).shrink, xscale=0.0, yscale=1.0)
+        self.assertRaises(ValueError,
+                          VImageAdapter(image).shrink, xscale=2.0, yscale=1.0)
+
+        # Not finite
+        for scale in (float('nan'), float('inf')):
+            self.assertRaises(ValueError, VImageAdapter(image).shrink,
+                              xscale=scale, yscale=1.0)
+            self.assertRaises(ValueError, VImageAdapter(image).shrink,
+                              xscale=1.0, yscale=scale)
+
     def test_shrink_affine(self):
         image = VImageAdapter.new_rgba(width=16, height=16)
 
@@ -191,6 +304,32 @@ class TestVipsDataset(GdalTestCase):
         self.assertEqual(dataset.RasterXSize, 256)
         self.assertEqual(dataset.RasterYSize, 256)
 
+    def test_sequential(self):
+        random = VipsDataset(inputfile=self.inputfile)
+        self.assertEqual(random.access, 'random')
+        sequential = VipsDataset(inputfile=self.inputfile,
+                                 access='sequential')
+        self.assertEqual(bytes(sequential.image.write_to_memory()),
+                         bytes(random.image.write_to_memory()))
+        self.assertRaises(ValueError, VipsDataset, inputfile=self.inputfile,
+                          access='backwards')
+
+    def test_load_shrunk(self):
+        # libtiff cannot shrink while decoding
+        dataset = VipsDataset(inputfile=self.inputfile)
+        self.assertEqual(dataset.load_shrunk(shrink=2), None)
+
+        # libjpeg can
+        with NamedTemporaryDir() as tempdir:
+            jpegfile = write_gradient_jpeg(tempdir, width=64, height=32)
+            dataset = VipsDataset(inputfile=jpegfile)
+            shrunk = dataset.load_shrunk(shrink=2)
+            self.assertEqual((shrunk.width, shrunk.height), (32, 16))
+
+            # Not once the image has been modified
+            dataset._image = dataset.image.invert()
+            self.assertEqual(dataset.load_shrunk(shrink=2), None)
+
     def test_align_to_grid(self):
         with LibVips.disable_warnings():
             # bluemarble.tif is a 1024 × 1024 whole-world map.
@@ -287,6 +426,29 @@ class TestTmsTiles(unittest.TestCase):
         self.assertEqual(tiles.image_width, 2)
         self.assertEqual(tiles.image_height, 1)
 
+    def test_render_strip(self):
+        image = VImageAdapter.new_rgba(width=TILE_SIDE * 2,
+                                       height=TILE_SIDE * 2)
+        tiles = TmsTiles(image=image,
+                         storage=Storage(renderer=None),
+                         tile_width=TILE_SIDE, tile_height=TILE_SIDE,
+                         offset=XY(0, 0), resolution=1)
+        strip = tiles._render_strip(y=TILE_SIDE)
+        self.assertEqual(strip.width, TILE_SIDE * 2)
+        self.assertEqual(strip.height, TILE_SIDE)
+        self.assertEqual(strip.bands, 4)
+
+    def test_tile_indices(self):
+        image = VImageAdapter.new_rgba(width=3, height=2)
+        tiles = TmsTiles(image=image,
+                         storage=Storage(renderer=None),
+                         tile_width=1, tile_height=1,
+                         offset=XY(2, 4), resolution=3)
+        xs, ys = tiles.tile_indices()
+        self.assertEqual(xs.tolist(), [[0, 2], [1, 3], [2, 4]])
+        # Rows are from the top, while TMS y is from the bottom.
+        self.assertEqual(ys.tolist(), [[0, 5], [1, 4]])
+
     def test_downsample(self):
         resolution = 2
         image = VImageAdapter.new_rgba(width=TILE_SIDE * 2 ** resolution,
@@ -372,6 +534,92 @@ class TestTmsTiles(unittest.TestCase):
                          resolution + 2)
 
 
+class TestTmsPyramid(unittest.TestCase):
+    def setUp(self):
+        # bluemarble.tif is a 1024 × 1024 whole-world map at resolution 2.
+        self.inputfile = os.path.join(__dir__, 'bluemarble.tif')
+
+    def slice(self, outputdir, resolution):
+        """Slices `resolution`, returning how inputfile was first loaded."""
+        pyramid = TmsPyramid(inputfile=self.inputfile,
+                             storage=NestedFileStorage(
+                                 outputdir=outputdir,
+                                 renderer=TouchRenderer(suffix='.png')
+                             ),
+                             min_resolution=resolution,
+                             max_resolution=resolution,
+                             sequential=True)
+        with mock.patch.object(Image, 'new_from_file',
+                               wraps=Image.new_from_file) as new_from_file:
+            # Load the image before slicing, like a preprocessor would.
+            self.assertTrue(pyramid.image.width)
+            pyramid.slice()
+        return new_from_file.call_args_list[0]
+
+    def test_sequential(self):
+        with NamedTemporaryDir() as outputdir:
+            loaded = self.slice(outputdir=outputdir, resolution=2)
+            self.assertEqual(loaded, mock.call(self.inputfile,
+                                               access='sequential'))
+            self.assertEqual(
+                set(f for f in recursive_listdir(outputdir)
+                    if f.endswith('.png')),
+                set('2/{0}/{1}.png'.format(x, y)
+                    for x in range(4) for y in range(4))
+            )
+
+    def test_downsample_on_load(self):
+        with NamedTemporaryDir() as tempdir:
+            jpegfile = write_gradient_jpeg(tempdir, width=TILE_SIDE * 4,
+                                           height=TILE_SIDE * 4)
+            downsampled = None
+            for shrink_on_load in (False, True):
+                pyramid = TmsPyramid(inputfile=jpegfile,
+                                     storage=Storage(renderer=None),
+                                     shrink_on_load=shrink_on_load)
+                tiles = TmsTiles(image=pyramid.image,
+                                 storage=pyramid.storage,
+                                 tile_width=TILE_SIDE, tile_height=TILE_SIDE,
+                                 offset=XY(0, 0), resolution=2)
+
+                shrunk = pyramid.downsample_on_load(tiles=tiles, levels=1)
+                self.assertEqual(shrunk.resolution, 1)
+                self.assertEqual((shrunk.image_width, shrunk.image_height),
+                                 (TILE_SIDE * 2, TILE_SIDE * 2))
+                if downsampled is None:
+                    downsampled = shrunk
+
+            # By default, the same pixels as TmsTiles.downsample
+            expected = tiles.downsample(levels=1).image
+            self.assertEqual(downsampled.image.write_to_memory(),
+                             expected.write_to_memory())
+
+            # Opting in, libjpeg shrinks while decoding. Its shrink isn't a
+            # box filter, so pixels may differ by a few levels.
+            self.assertEqual(shrunk.image.get('vips-loader'), 'jpegload')
+            diff = (shrunk.image - downsampled.image).abs()
+            self.assertLessEqual(diff.max(), 8)
+
+            # Several levels at once
+            shrunk = pyramid.downsample_on_load(tiles=tiles, levels=2)
+            self.assertEqual(shrunk.resolution, 0)
+            self.assertEqual((shrunk.image_width, shrunk.image_height),
+                             (TILE_SIDE, TILE_SIDE))
+
+    def test_sequential_downsample(self):
+        # Shrinking reads the input out of order, so it stays random access.
+        with NamedTemporaryDir() as outputdir:
+            loaded = self.slice(outputdir=outputdir, resolution=1)
+            self.assertEqual(loaded, mock.call(self.inputfile,
+                                               access='random'))
+            self.assertEqual(
+                set(f for f in recursive_listdir(outputdir)
+                    if f.endswith('.png')),
+                set('1/{0}/{1}.png'.format(x, y)
+                    for x in range(2) for y in range(2))
+            )
+
+
 class TestColors(unittest.TestCase):
     def setUp(self):
         self.transparent = rgba(0, 0, 0, 0)